@@ -3,7 +3,7 @@ Module for processing and adding raw data to specified crops within a dataset.
 
 This module provides functionality to add raw data alongside labels for crops
 specified in a configuration YAML file. It uses asynchronous processing to handle
-multiple crops concurrently, leveraging background tasks for efficiency.
+multiple datasets concurrently, running them in a bounded thread pool.
 
 Key Functions:
 -------------
@@ -15,12 +15,14 @@ Key Functions:
 Dependencies:
 ------------
 - asyncio: For asynchronous programming.
+- dask: For streaming the cropped raw data to zarr chunk by chunk.
+- json: For writing the raw attributes.
 - logging: For logging messages and errors.
 - pathlib: For handling filesystem paths.
 - fibsem_tools: Custom library for reading xarray data.
 - numpy: For numerical operations and array handling.
-- yaml: For reading configuration files in YAML format.
 - zarr: For storing large arrays in a hierarchical format.
+- cellmap_utils_kit.misc_utils: For loading the data configuration yaml.
 
 Usage:
 -----
@@ -38,75 +40,134 @@ add_raw_main("path/to/config.yaml", concurrence=2)
 """
 
 import asyncio
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import dask.array as da
 import fibsem_tools as fst
 import numpy as np
-import yaml
 import zarr
+from zarr.storage import attrs_key
 
 from cellmap_utils_kit.attribute_handler import (
     add_scalelevel_to_attributes,
     initialize_multiscale_attributes,
 )
-from cellmap_utils_kit.parallel_utils import background
+from cellmap_utils_kit.misc_utils import load_data_yaml
+from cellmap_utils_kit.parallel_utils import gather_bounded
 
 logger = logging.getLogger(__name__)
 
 
-@background
+def _is_chunk_aligned(
+    chunks: tuple[tuple[int, ...], ...], chunksize: tuple[int, ...]
+) -> bool:
+    # dask chunks only line up with the zarr chunks if every block but the last one
+    # along each axis spans a whole number of zarr chunks
+    return all(
+        all(c % cs == 0 for c in dim_chunks[:-1])
+        for dim_chunks, cs in zip(chunks, chunksize)
+    )
+
+
+def _get_reference_label(crop_path: Path) -> Path:
+    # crops of a dataset can annotate different classes, so the reference label is
+    # looked up per crop
+    cropgroup_zarr = zarr.open_group(crop_path, "r")
+    if "labels" in cropgroup_zarr:
+        labels = cropgroup_zarr["labels"].attrs["cellmap"]["annotation"]["class_names"]
+        return crop_path / "labels" / labels[0]
+    labels = cropgroup_zarr.attrs["cellmap"]["annotation"]["class_names"]
+    return crop_path / labels[0]
+
+
 def _add_raw(dataname: str, datainfo: dict) -> None:
+    crop_group = Path(datainfo["crop_group"])
+    raw_path = Path(datainfo["raw"])
+    # the raw source and its grid don't depend on the crop
+    raw_src_xarr = fst.read_xarray(raw_path / "s0")
+    raw_res = {dim: float(c[1] - c[0]) for dim, c in raw_src_xarr.coords.items()}
+    raw_origin = {dim: float(c[0]) for dim, c in raw_src_xarr.coords.items()}
     for crop in datainfo["crops"]:
-        cropgroup = Path(datainfo["crop_group"]) / crop
-        cropgroup_zarr = zarr.open_group(cropgroup, "a")
-        rawgroup_dst = cropgroup_zarr.create_group("raw", overwrite=True)
-        raw_src_xarr = fst.read_xarray(Path(datainfo["raw"]) / "s0")
-        raw_res = {dim: float(c[1] - c[0]) for dim, c in raw_src_xarr.coords.items()}
-        if "labels" in cropgroup_zarr:
-            labels = cropgroup_zarr["labels"].attrs["cellmap"]["annotation"][
-                "class_names"
-            ]
-            ref_lbl = labels[0]
-            ref_crop = Path(datainfo["crop_group"]) / crop / "labels" / ref_lbl
-        else:
-            labels = cropgroup_zarr.attrs["cellmap"]["annotation"]["class_names"]
-            ref_lbl = labels[0]
-            ref_crop = Path(datainfo["crop_group"]) / crop / ref_lbl
-
+        crop_path = crop_group / crop
+        ref_crop = _get_reference_label(crop_path)
         lbl_src_xarr = fst.read_xarray(ref_crop / "s0")
-        lbl_res = {dim: c[1] - c[0] for dim, c in lbl_src_xarr.coords.items()}
-        start = {dim: c[0] for dim, c in lbl_src_xarr.coords.items()}
-        end = {dim: c[-1] for dim, c in lbl_src_xarr.coords.items()}
-        raw_sel_coords = {}
-        for dim in start.keys():
-            start_raw = start[dim] - lbl_res[dim] / 2 + raw_res[dim] / 2
-            end_raw = end[dim] + lbl_res[dim] / 2 - raw_res[dim] / 2
-            raw_sel_coords[dim] = np.arange(
-                start_raw, end_raw + raw_res[dim], raw_res[dim]
-            ).tolist()
-        try:
-            raw_crop = raw_src_xarr.sel(raw_sel_coords)
-        except KeyError as e:
+        dims = lbl_src_xarr.dims
+        lbl_coords = [lbl_src_xarr.coords[dim].values for dim in dims]
+        lbl_res_arr = np.array([c[1] - c[0] for c in lbl_coords])
+        raw_res_arr = np.array([raw_res[dim] for dim in dims])
+        start_raw = (
+            np.array([c[0] for c in lbl_coords]) - lbl_res_arr / 2 + raw_res_arr / 2
+        )
+        end_raw = (
+            np.array([c[-1] for c in lbl_coords]) + lbl_res_arr / 2 - raw_res_arr / 2
+        )
+        # raw and label grids are regular, so slice by index instead of label
+        raw_origin_arr = np.array([raw_origin[dim] for dim in dims])
+        raw_shape = np.array([raw_src_xarr.sizes[dim] for dim in dims])
+        start_idx = np.rint((start_raw - raw_origin_arr) / raw_res_arr).astype(int)
+        num_vox = np.rint((end_raw - start_raw) / raw_res_arr).astype(int) + 1
+        end_idx = start_idx + num_vox
+        err = None
+        if not np.allclose(raw_origin_arr + start_idx * raw_res_arr, start_raw):
+            err = f"Crop offset {start_raw} is not on the raw grid"
+        elif np.any(start_idx < 0) or np.any(end_idx > raw_shape):
+            err = f"Crop index range {start_idx}:{end_idx} exceeds raw shape"
+        if err is not None:
             msg = f"Could not extract raw in {dataname}: {crop}"
             logger.info(msg)
-            logger.error(e)
+            logger.error(err)
             continue
+        # an existing raw group is only replaced once the crop is known to be valid
+        rawgroup_dst = zarr.open_group(crop_path / "raw", "w")
+        raw_crop = raw_src_xarr.isel(
+            {
+                dim: slice(int(start_idx[k]), int(end_idx[k]))
+                for k, dim in enumerate(dims)
+            }
+        )
+        raw_offset = dict(zip(dims, start_raw))
         raw_attrs = add_scalelevel_to_attributes(
             initialize_multiscale_attributes(),
             "s0",
             [raw_res[k] for k in "zyx"],
-            [raw_sel_coords[k][0] for k in "zyx"],
+            [float(raw_offset[k]) for k in "zyx"],
         )
 
-        rawgroup_dst.attrs.put(raw_attrs)
+        # the raw group was just created, so its attributes can be written in one go
+        # instead of through zarr's read-merge-write of .zattrs
+        raw_attrs_key = "/".join(filter(None, (rawgroup_dst.path, attrs_key)))
+        rawgroup_dst.store[raw_attrs_key] = json.dumps(
+            raw_attrs, separators=(",", ":")
+        ).encode()
         chunksize = (1, *raw_crop.shape[1:])
-        rawgroup_dst.create_dataset(
-            "s0", data=raw_crop.data.compute(), chunks=chunksize, overwrite=True
+        raw_dst = rawgroup_dst.create_dataset(
+            "s0",
+            shape=raw_crop.shape,
+            dtype=raw_crop.dtype,
+            chunks=chunksize,
+            overwrite=True,
         )
+        raw_data = raw_crop.data
+        if not _is_chunk_aligned(raw_data.chunks, chunksize):
+            raw_data = raw_data.rechunk(chunksize)
+        # blocks map onto disjoint zarr chunks, so they can be written without a lock
+        da.store(raw_data, raw_dst, lock=False, compute=True)
         logger.info(f"Successfully added raw in {dataname}: {crop}")
 
 
+async def _add_raw_async_main(datasets: dict, max_concurrency: None | int) -> None:
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        await gather_bounded(
+            _add_raw,
+            datasets.items(),
+            max_concurrency=max_concurrency,
+            executor=pool,
+        )
+
+
 def add_raw_main(data_yaml: str, max_concurrency: None | int = None) -> None:
     """Adds raw data alongside labels to crops specified in `data_yaml`.
 
@@ -116,15 +177,5 @@ def add_raw_main(data_yaml: str, max_concurrency: None | int = None) -> None:
             None, no limit is set. Defaults to None.
 
     """
-    loop = asyncio.get_event_loop()
-    with open(data_yaml) as f:
-        datasets = yaml.safe_load(f)["datasets"]
-        task_list = []
-        for dataname, datainfo in datasets.items():
-            task_list.append(_add_raw(dataname, datainfo))
-            if len(task_list) == max_concurrency:
-                looper = asyncio.gather(*task_list)
-                loop.run_until_complete(looper)
-                task_list = []
-        looper = asyncio.gather(*task_list)
-        loop.run_until_complete(looper)
+    datasets = load_data_yaml(data_yaml)["datasets"]
+    asyncio.run(_add_raw_async_main(datasets, max_concurrency))
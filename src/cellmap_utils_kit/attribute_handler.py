@@ -3,6 +3,7 @@ cellmap-utils.kit.attribute_handler: Utility functions to deal with cellmap
     style attributes.
 """
 
+import functools
 import json
 from typing import Sequence
 
@@ -10,23 +11,59 @@ import h5py
 import zarr
 
 
+@functools.lru_cache(maxsize=1024)
+def _decode_attribute_json(attr: str) -> dict:
+    cellmap_attr_decoded: dict = json.loads(attr)
+    return cellmap_attr_decoded
+
+
 def access_attributes(attr: str | dict) -> dict:
     """Decode a nested attribute if it is encoded as a json-string. Otherwise just
-    return it.
+    return it. Json-strings are only decoded once, crops of a dataset usually share
+    the same encoded attributes.
 
     Args:
         attr (str | dict): Attribute that potentially needs to be decoded
 
     Returns:
-        dict: Nested attribute as dictionary.
+        dict: Nested attribute as dictionary. Must not be modified as it may be
+            shared between calls.
 
     """
     if isinstance(attr, str):
-        cellmap_attr_decoded: dict = json.loads(attr)
-        return cellmap_attr_decoded
+        return _decode_attribute_json(attr)
     return attr
 
 
+def _build_multiscales_index(ms_attrs: list) -> dict[str, list[dict]]:
+    return {
+        ds["path"]: ds["coordinateTransformations"] for ds in ms_attrs[0]["datasets"]
+    }
+
+
+@functools.lru_cache(maxsize=256)
+def _index_multiscales_json(ms_json: str) -> dict[str, list[dict]]:
+    return _build_multiscales_index(json.loads(ms_json))
+
+
+def _index_multiscales(ms_attrs: str | list) -> dict[str, list[dict]]:
+    """Map the path of each scale level in a multiscales attribute to its coordinate
+    transformations. Json-encoded attributes are only decoded and indexed once.
+
+    Args:
+        ms_attrs (str | list): The "multiscales" attribute, potentially encoded as a
+            json-string.
+
+    Returns:
+        dict[str, list[dict]]: Mapping <name of scale array> -> <coordinate
+            transformations>. Must not be modified as it may be shared between calls.
+
+    """
+    if isinstance(ms_attrs, str):
+        return _index_multiscales_json(ms_attrs)
+    return _build_multiscales_index(ms_attrs)
+
+
 def get_res_dict_from_attrs(
     attrs: h5py.AttributeManager | zarr.attrs.Attributes | dict,
 ) -> dict[str, Sequence[float | int]]:
@@ -43,11 +80,10 @@ def get_res_dict_from_attrs(
 
     """
     result = {}
-    ms_attrs = access_attributes(attrs["multiscales"])
-    for ds in ms_attrs[0]["datasets"]:
-        for ct in ds["coordinateTransformations"]:
+    for path, cts in _index_multiscales(attrs["multiscales"]).items():
+        for ct in cts:
             if ct["type"] == "scale":
-                result[ds["path"]] = ct["scale"]
+                result[path] = list(ct["scale"])
                 break
     return result
 
@@ -210,27 +246,27 @@ def get_scale_and_translation(
             translation values, respectively.
 
     """
-    for ms in attrs_as_dict["multiscales"][0]["datasets"]:
-        if ms["path"] == scalelvl:
-            scale = None
-            translation = None
-            for ct in ms["coordinateTransformations"]:
-                if ct["type"] == "scale":
-                    scale = ct["scale"]
-                elif ct["type"] == "translation":
-                    translation = ct["translation"]
-                else:
-                    msg = (
-                        f"Unknown coordinate transformation type in attributes for "
-                        f"{scalelvl}: {ct['type']}"
-                    )
-                    raise ValueError(msg)
-            if translation is None or scale is None:
-                msg = (
-                    f"Did not find translation and scale value in attributes for "
-                    f"{scalelvl}: {translation=}, {scale=}"
-                )
-                raise ValueError(msg)
-            return scale, translation
-    msg = f"Did not find attributes for {scalelvl} in {attrs_as_dict}"
-    raise ValueError(msg)
+    cts = _index_multiscales(attrs_as_dict["multiscales"]).get(scalelvl)
+    if cts is None:
+        msg = f"Did not find attributes for {scalelvl} in {attrs_as_dict}"
+        raise ValueError(msg)
+    scale = None
+    translation = None
+    for ct in cts:
+        if ct["type"] == "scale":
+            scale = ct["scale"]
+        elif ct["type"] == "translation":
+            translation = ct["translation"]
+        else:
+            msg = (
+                f"Unknown coordinate transformation type in attributes for "
+                f"{scalelvl}: {ct['type']}"
+            )
+            raise ValueError(msg)
+    if translation is None or scale is None:
+        msg = (
+            f"Did not find translation and scale value in attributes for "
+            f"{scalelvl}: {translation=}, {scale=}"
+        )
+        raise ValueError(msg)
+    return list(scale), list(translation)
@@ -10,19 +10,21 @@ Key Functions:
 --------------
 
 - `check_data_yaml_main(data_yaml: str, label_scalelevels: tuple[str, ...] = (),
-    raw_scalelevels: tuple[str, ...] = ()) -> None`: Iterates through all datasets
-    specified in a YAML file, checks for their existence, and validates them.
+    raw_scalelevels: tuple[str, ...] = (), *, deep: bool = False) -> None`:
+    Iterates through all datasets specified in a YAML file, checks for their
+    existence, and validates them.
 
 Dependencies:
 -------------
 - asyncio: For managing asynchronous checks of multiple datasets.
+- functools: For binding keyword options of the per-crop checks.
 - logging: For logging error messages and progress information.
-- pathlib: For path manipulation and handling.
-- yaml: For loading dataset configurations from a YAML file.
+- os, pathlib: For path manipulation and handling.
 - fibsem_tools: For reading data stored in Zarr or HDF5 files.
 - cellmap_utils.kit.attribute_handler: To flexibly handle Zarr and HDF5 attributes
 - cellmap_utils.kit.h5_xarray_reader: To read Zarr or HDF5 mutliscale data.
-- cellmap_utils_kit.parallel_utils: For running background tasks.
+- cellmap_utils_kit.misc_utils: For loading the data configuration yaml.
+- cellmap_utils_kit.parallel_utils: For running checks in a bounded thread pool.
 
 Usage:
 ------
@@ -40,85 +42,173 @@ check_data_yaml_main("path/to/data_config.yaml")
 """
 
 import asyncio
+import functools
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import fibsem_tools as fst
-import yaml
 
 from cellmap_utils_kit.attribute_handler import access_attributes
 from cellmap_utils_kit.h5_xarray_reader import read_any_xarray
-from cellmap_utils_kit.parallel_utils import background
+from cellmap_utils_kit.misc_utils import load_data_yaml
+from cellmap_utils_kit.parallel_utils import gather_bounded
 
 logger = logging.getLogger(__name__)
 
 
-def _check_crop(datainfo: dict, crop: str, scalelevels: tuple[str, ...] = ()) -> None:
+def _check_crop(
+    crop_path: str, scalelevels: tuple[str, ...] = (), *, deep: bool = False
+) -> None:
+    crop = os.path.basename(crop_path)
     try:
         # check that crop exists in the crop group
-        if not (Path(datainfo["crop_group"]) / crop).exists():
-            msg = f"{Path(datainfo['crop_group'])/crop} does not exist"
+        if not os.path.exists(crop_path):
+            msg = f"{crop_path} does not exist"
             raise ValueError(msg)
-        # check that scale levels exists for all labels
-        crop_hdl = fst.read(Path(datainfo["crop_group"]) / crop)
+        # check that scale levels exists for all labels, by membership in the
+        # listing of each label group unless arrays should be opened as well
+        crop_hdl = fst.read(crop_path)
         if "labels" in crop_hdl:
-            crop_hdl = crop_hdl["labels"]
-            croplbl_path = Path(datainfo["crop_group"]) / crop / "labels"
+            lbl_hdl = crop_hdl["labels"]
+            croplbl_path = f"{crop_path}/labels"
         else:
-            croplbl_path = Path(datainfo["crop_group"]) / crop
-        labels = access_attributes(fst.read(croplbl_path).attrs["cellmap"])[
-            "annotation"
-        ]["class_names"]
+            lbl_hdl = crop_hdl
+            croplbl_path = crop_path
+        labels = access_attributes(lbl_hdl.attrs["cellmap"])["annotation"][
+            "class_names"
+        ]
+        lbl_members = set(lbl_hdl)
         for lbl in labels:
+            if lbl not in lbl_members:
+                msg = f"label {lbl} does not exist"
+                raise ValueError(msg)
+            lbl_grp = lbl_hdl[lbl]
+            sclvl_members = set(lbl_grp)
             for sclvl in scalelevels:
-                read_any_xarray(croplbl_path / lbl / sclvl)
+                if sclvl not in sclvl_members:
+                    msg = f"scale level {sclvl} of label {lbl} does not exist"
+                    raise ValueError(msg)
+                if deep:
+                    # reading the scale level validates its multiscale metadata and
+                    # coordinates as well
+                    read_any_xarray(f"{croplbl_path}/{lbl}/{sclvl}")
     except Exception as e:
         logger.error(f"{e}, crop: {crop}")
 
 
 def _check_crop_for_raw(
-    datainfo: dict, crop: str, scalelevels: tuple[str, ...] = ()
+    crop_path: str, scalelevels: tuple[str, ...] = (), *, deep: bool = False
 ) -> None:
+    crop = os.path.basename(crop_path)
     try:
-        read_any_xarray(Path(datainfo["crop_group"]) / crop / "raw")
+        if deep:
+            raw_members = set(read_any_xarray(f"{crop_path}/raw"))
+        else:
+            raw_members = set(fst.read(f"{crop_path}/raw"))
     except Exception as e:
         logger.error(f"{e}, crop: {crop}")
     else:
         try:
             for sclvl in scalelevels:
-                # could be replaced by making use of data tree
-                read_any_xarray(Path(datainfo["crop_group"]) / crop / "raw" / sclvl)
+                if sclvl not in raw_members:
+                    msg = f"scale level {sclvl} of raw does not exist"
+                    raise ValueError(msg)
         except Exception as e:
             logger.error(f"{e}, crop: {crop}")
 
 
-@background
-def _check_dataset(
-    dataname: str,
-    datainfo: dict,
-    label_scalelevels: tuple[str, ...] = (),
-    raw_scalelevels: tuple[str, ...] = (),
-) -> None:
+def _check_dataset_paths(
+    dataname: str, datainfo: dict, raw_scalelevels: tuple[str, ...] = ()
+) -> bool:
     try:
         if "raw" in datainfo:
+            raw_path = Path(datainfo["raw"])
             # check that raw path exists
-            if not Path(datainfo["raw"]).exists():
-                msg = f"{Path(datainfo['raw'])} does not exist"
+            if not raw_path.exists():
+                msg = f"{raw_path} does not exist"
                 raise ValueError(msg)
             # check that scale levels are openable for raw
             for sclvl in raw_scalelevels:
-                read_any_xarray(Path(datainfo["raw"]) / sclvl)
+                read_any_xarray(raw_path / sclvl)
         # check that crop group exists
-        if not Path(datainfo["crop_group"]).exists():
-            msg = f"{Path(datainfo['crop_group'])} does not exist"
+        crop_group = Path(datainfo["crop_group"])
+        if not crop_group.exists():
+            msg = f"{crop_group} does not exist"
             raise ValueError(msg)
-        # check each of the crops
-        for crop in datainfo["crops"]:
-            _check_crop(datainfo, crop, scalelevels=label_scalelevels)
-            if "raw" not in datainfo:
-                _check_crop_for_raw(datainfo, crop, scalelevels=raw_scalelevels)
     except Exception as e:
         logger.error(f"{e}, {dataname}")
+        return False
+    return True
+
+
+def _check_single_crop(
+    crop_path: str,
+    label_scalelevels: tuple[str, ...] = (),
+    raw_scalelevels: tuple[str, ...] | None = None,
+    *,
+    deep: bool = False,
+) -> None:
+    _check_crop(crop_path, scalelevels=label_scalelevels, deep=deep)
+    if raw_scalelevels is not None:
+        _check_crop_for_raw(crop_path, scalelevels=raw_scalelevels, deep=deep)
+
+
+async def _check_dataset(
+    dataname: str,
+    datainfo: dict,
+    label_scalelevels: tuple[str, ...] = (),
+    raw_scalelevels: tuple[str, ...] = (),
+    *,
+    max_concurrency: int | None = None,
+    executor: ThreadPoolExecutor | None = None,
+    deep: bool = False,
+) -> None:
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(
+        executor, _check_dataset_paths, dataname, datainfo, raw_scalelevels
+    ):
+        return
+    # check each of the crops concurrently, checking for raw in the crop if the
+    # dataset does not have a dataset-level raw path
+    # crop paths are plain strings, building Path objects adds up over many crops
+    crop_group = datainfo["crop_group"].rstrip("/")
+    crop_raw_scalelevels = None if "raw" in datainfo else raw_scalelevels
+    await gather_bounded(
+        functools.partial(_check_single_crop, deep=deep),
+        (
+            (f"{crop_group}/{crop}", label_scalelevels, crop_raw_scalelevels)
+            for crop in datainfo["crops"]
+        ),
+        max_concurrency=max_concurrency,
+        executor=executor,
+    )
+
+
+async def _check_data_yaml_async_main(
+    datasets: dict,
+    label_scalelevels: tuple[str, ...],
+    raw_scalelevels: tuple[str, ...],
+    max_concurrency: None | int,
+    *,
+    deep: bool,
+) -> None:
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        await asyncio.gather(
+            *(
+                _check_dataset(
+                    dataname,
+                    datainfo,
+                    label_scalelevels=label_scalelevels,
+                    raw_scalelevels=raw_scalelevels,
+                    max_concurrency=max_concurrency,
+                    executor=pool,
+                    deep=deep,
+                )
+                for dataname, datainfo in datasets.items()
+            )
+        )
 
 
 def check_data_yaml_main(
@@ -126,6 +216,8 @@ def check_data_yaml_main(
     label_scalelevels: tuple[str, ...] = (),
     raw_scalelevels: tuple[str, ...] = (),
     max_concurrency: None | int = None,
+    *,
+    deep: bool = False,
 ) -> None:
     """Check that data specified in a data configuration yaml exists and is readable.
 
@@ -140,25 +232,19 @@ def check_data_yaml_main(
             checked for raw data. Defaults to ().
         max_concurrency (int, optional): Maximum number of concurrent processes. If
             None, no limit is set. Defaults to None.
+        deep (bool, optional): If True, read every checked scale level as an xarray,
+            which validates its multiscale metadata and coordinates, instead of only
+            checking that it exists in its group. Defaults to False.
 
     """
-    loop = asyncio.get_event_loop()
-    task_list = []
-    with open(data_yaml) as f:
-        datasets = yaml.safe_load(f)["datasets"]
-        for dataname, datainfo in datasets.items():
-            task_list.append(
-                _check_dataset(
-                    dataname,
-                    datainfo,
-                    label_scalelevels=label_scalelevels,
-                    raw_scalelevels=raw_scalelevels,
-                )
-            )
-            if len(task_list) == max_concurrency:
-                looper = asyncio.gather(*task_list)
-                loop.run_until_complete(looper)
-                task_list = []
-    looper = asyncio.gather(*task_list)
-    loop.run_until_complete(looper)
+    datasets = load_data_yaml(data_yaml)["datasets"]
+    asyncio.run(
+        _check_data_yaml_async_main(
+            datasets,
+            label_scalelevels,
+            raw_scalelevels,
+            max_concurrency,
+            deep=deep,
+        )
+    )
     logger.info("all done!")
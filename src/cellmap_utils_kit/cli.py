@@ -21,7 +21,7 @@ for each command, e.g. `data-prep copy-crops --help`
 """
 
 import logging
-from typing import Sequence
+from typing import Literal, Sequence
 
 import click
 
@@ -99,11 +99,19 @@ def copy_crops_cli(
     default=None,
     help="Limit the number of tasks that are run concurrently.",
 )
+@click.option(
+    "--deep",
+    is_flag=True,
+    default=False,
+    help="Open every checked scale level instead of only checking that it exists.",
+)
 def check_data_yaml_cli(
     data_yaml: str,
     label_scalelevels: tuple[str, ...] = (),
     raw_scalelevels: tuple[str, ...] = (),
     max_concurrency: None | int = None,
+    *,
+    deep: bool = False,
 ) -> None:
     """Check that data specified in a data configuration yaml is valid.
 
@@ -115,6 +123,8 @@ def check_data_yaml_cli(
             openable for raw data. Defaults. to empty tuple.
         max_concurrency (int, optional): Maximum number of concurrent processes. If
             None, no limit is set. Defaults to None.
+        deep (bool): Whether to open every checked scale level array instead of only
+            checking that it exists. Defaults to False.
 
     """
     check_data_yaml_main(
@@ -122,6 +132,7 @@ def check_data_yaml_cli(
         label_scalelevels=label_scalelevels,
         raw_scalelevels=raw_scalelevels,
         max_concurrency=max_concurrency,
+        deep=deep,
     )
 
 
@@ -136,8 +147,25 @@ def check_data_yaml_cli(
     default=None,
     help="Limit the number of tasks that are run concurrently.",
 )
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Keep complete scale levels that already exist instead of recomputing them.",
+)
+@click.option(
+    "--compressor",
+    type=click.Choice(["zstd", "lz4", "none"]),
+    default="zstd",
+    help="Compression of the downscaled levels.",
+)
 def smooth_multiscale_labels_cli(
-    data_yaml: str, num_scales: int = 4, max_concurrency: None | int = None
+    data_yaml: str,
+    num_scales: int = 4,
+    max_concurrency: None | int = None,
+    *,
+    resume: bool = False,
+    compressor: Literal["zstd", "lz4", "none"] = "zstd",
 ) -> None:
     """Generate multiscale pyramid for labels. Results in label smoothing.
 
@@ -146,10 +174,18 @@ def smooth_multiscale_labels_cli(
         num_scales (int, optional): Desired number of scale levels. Defaults to 4.
         max_concurrency (int, optional): Maximum number of concurrent processes. If
             None, no limit is set. Defaults to None.
+        resume (bool): Whether to keep scale levels that already exist with the
+            expected shape instead of recomputing them. Defaults to False.
+        compressor (Literal["zstd", "lz4", "none"], optional): Compression of the
+            downscaled levels. Defaults to "zstd".
 
     """
     smooth_multiscale_labels_main(
-        data_yaml, num_scales=num_scales, max_concurrency=max_concurrency
+        data_yaml,
+        num_scales=num_scales,
+        max_concurrency=max_concurrency,
+        resume=resume,
+        compressor=compressor,
     )
 
 
@@ -184,8 +220,25 @@ def add_raw_cli(data_yaml: str, max_concurrency: int | None = None) -> None:
     default=None,
     help="Limit the number of tasks that are run concurrently.",
 )
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Keep complete scale levels that already exist instead of recomputing them.",
+)
+@click.option(
+    "--compressor",
+    type=click.Choice(["zstd", "lz4", "none"]),
+    default="zstd",
+    help="Compression of the downscaled levels.",
+)
 def smooth_multiscale_raw_cli(
-    data_yaml: str, num_scales: int = 4, max_concurrency: int | None = None
+    data_yaml: str,
+    num_scales: int = 4,
+    max_concurrency: int | None = None,
+    *,
+    resume: bool = False,
+    compressor: Literal["zstd", "lz4", "none"] = "zstd",
 ) -> None:
     """Generate multiscale pyramid for raw. Results in label smoothing.
 
@@ -194,10 +247,18 @@ def smooth_multiscale_raw_cli(
         num_scales (int, optional): Desired number of scale levels. Defaults to 4.
         max_concurrency (int, optional): Maximum number of concurrent processes. If
             None, no limit is set. Defaults to None.
+        resume (bool): Whether to keep scale levels that already exist with the
+            expected shape instead of recomputing them. Defaults to False.
+        compressor (Literal["zstd", "lz4", "none"], optional): Compression of the
+            downscaled levels. Defaults to "zstd".
 
     """
     smooth_multiscale_raw_main(
-        data_yaml, num_scales=num_scales, max_concurrency=max_concurrency
+        data_yaml,
+        num_scales=num_scales,
+        max_concurrency=max_concurrency,
+        resume=resume,
+        compressor=compressor,
     )
 
 
@@ -210,8 +271,21 @@ def smooth_multiscale_raw_cli(
     default=None,
     help="Limit the number of tasks that are run concurrently.",
 )
+@click.option(
+    "--consolidated",
+    is_flag=True,
+    default=False,
+    help=(
+        "Read existing consolidated metadata of the crops. It is not updated when "
+        "crops change, so only use this if it is current."
+    ),
+)
 def h5_export_cli(
-    data_yaml: str, destination: str, max_concurrency: int | None = None
+    data_yaml: str,
+    destination: str,
+    max_concurrency: int | None = None,
+    *,
+    consolidated: bool = False,
 ) -> None:
     """Export crops from zarr to h5.
 
@@ -220,9 +294,17 @@ def h5_export_cli(
         destination (str): Folder to which crops should be copied
         max_concurrency (int, optional): Maximum number of concurrent processes. If
             None, no limit is set. Defaults to None.
+        consolidated (bool): Whether to read the metadata of crops from their existing
+            consolidated metadata, which is not updated when crops change. Defaults to
+            False.
 
     """
-    h5_export_main(data_yaml, destination, max_concurrency=max_concurrency)
+    h5_export_main(
+        data_yaml,
+        destination,
+        max_concurrency=max_concurrency,
+        consolidated=consolidated,
+    )
 
 
 @click.command(name="correct-attrs")
@@ -285,6 +367,21 @@ def correct_attrs_cli(data_yaml: str, max_concurrency: int | None = None) -> Non
     multiple=True,
     help="Labels to consider for checking the minimum percentage of annotations",
 )
+@click.option(
+    "--max-concurrency",
+    type=int,
+    default=None,
+    help="Limit the number of crops that are checked concurrently.",
+)
+@click.option(
+    "--consolidated",
+    is_flag=True,
+    default=False,
+    help=(
+        "Read existing consolidated metadata of the crop groups. It is not updated "
+        "when crops change, so only use this if it is current."
+    ),
+)
 def filter_yaml_cli(
     data_yaml: str,
     data_yaml_filtered: str,
@@ -292,6 +389,9 @@ def filter_yaml_cli(
     min_size: Sequence[int] | None = None,
     min_frac_annotated: float | None = None,
     labels: Sequence[str] = (),
+    max_concurrency: None | int = None,
+    *,
+    consolidated: bool = False,
 ) -> None:
     """Filter the list of crops in a data configuration yaml.
 
@@ -311,6 +411,12 @@ def filter_yaml_cli(
             Defaults to None.
         labels (Sequence[str], optional): List of labels for which to check annotation
             fraction. Defaults to ().
+        max_concurrency (int, optional): Maximum number of crops that are checked
+            concurrently. If None, a default based on the number of CPUs is used.
+            Defaults to None.
+        consolidated (bool): Whether to read the metadata of crop groups from their
+            existing consolidated metadata, which is not updated when crops change.
+            Defaults to False.
 
     """
     filter_yaml_main(
@@ -320,6 +426,8 @@ def filter_yaml_cli(
         min_size=min_size,
         min_frac_annotated=min_frac_annotated,
         labels=labels,
+        max_concurrency=max_concurrency,
+        consolidated=consolidated,
     )
 
 
@@ -2,8 +2,8 @@
 Module for handling the copying of crop datasets from CellMap data.
 
 This module provides functionality to copy crop datasets described in a YAML
-configuration file to a specified destination directory. It utilizes asynchronous
-processing to copy multiple datasets in parallel.
+configuration file to a specified destination directory. It utilizes a process pool
+to copy multiple crops in parallel.
 
 Key Functions:
 --------------
@@ -14,11 +14,13 @@ Key Functions:
 
 Dependencies:
 -------------
-- asyncio: For asynchronous processing.
+- concurrent.futures: For copying crops in parallel processes and streaming
+  arrays with several transfers in flight.
+- fcntl, os, shutil: For copying chunk files without re-encoding them.
 - logging: For logging progress and information during execution.
 - pathlib: For path manipulation and handling.
-- yaml: For reading the dataset configuration from a YAML file.
 - zarr: For managing Zarr file storage and dataset organization.
+- cellmap_utils_kit.misc_utils: For loading the data configuration yaml.
 
 Usage:
 ------
@@ -34,44 +36,126 @@ copy_crops_main("path/to/config.yaml", "path/to/destination")
 
 """
 
-import asyncio
 import logging
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-import yaml
 import zarr
 
 from cellmap_utils_kit.attribute_handler import extract_single_scale_attrs
-from cellmap_utils_kit.parallel_utils import background
+from cellmap_utils_kit.misc_utils import load_data_yaml
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None  # type: ignore[assignment]
 
 logger = logging.getLogger(__name__)
 
+_COPY_BUFSIZE = 1024 * 1024
+_COPY_THREADS = 8
+# ioctl request for copy-on-write clones on btrfs/xfs, exposed by fcntl from py3.12
+_FICLONE = (
+    getattr(fcntl, "FICLONE", 0x40049409)
+    if fcntl is not None and sys.platform == "linux"
+    else None
+)
+
+
+def _clone_file(src: Path, dst: Path) -> None:
+    # prefer a copy-on-write clone, then an in-kernel copy, then a buffered copy
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if _FICLONE is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass
+        if hasattr(os, "copy_file_range"):
+            try:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), _COPY_BUFSIZE):
+                    pass
+                return
+            except OSError:
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, _COPY_BUFSIZE)
+
+
+def _copy_chunk_files(src: zarr.Array, dst: zarr.Array) -> None:
+    # chunks are identical in source and destination, so chunk files can be copied
+    # as is instead of decompressing and recompressing them
+    trailing = (0,) * (dst.ndim - 1)
+    for z in range(dst.shape[0]):
+        src_file = Path(src.store.path) / src.store._normalize_key(
+            src._chunk_key((z, *trailing))
+        )
+        if not src_file.exists():  # chunk is all fill_value
+            continue
+        dst_file = Path(dst.store.path) / dst.store._normalize_key(
+            dst._chunk_key((z, *trailing))
+        )
+        dst_file.parent.mkdir(parents=True, exist_ok=True)
+        _clone_file(src_file, dst_file)
+
+
+def _stream_copy(src: zarr.Array, dst: zarr.Array) -> None:
+    # copy in slabs of whole source chunks along the first axis, so every source chunk
+    # is decoded once and only a few slabs are held in memory at any time
+    step = max(src.chunks[0], 1)
+
+    def _copy_slab(start: int) -> None:
+        dst[start : start + step] = src[start : start + step]
 
-@background
-def _copy_cellmap_dataset(dataname: str, datainfo: dict, destination: str) -> None:
+    with ThreadPoolExecutor(max_workers=_COPY_THREADS) as pool:
+        for _ in pool.map(_copy_slab, range(0, src.shape[0], step)):
+            pass
+
+
+def _copy_single_crop(
+    dataname: str, crop: str, crop_group: str, destination: str
+) -> None:
     destination_path = Path(destination)
-    for crop in datainfo["crops"]:
-        (destination_path / dataname).mkdir(exist_ok=True)
-        logger.info(f"Copying crop {Path(datainfo['crop_group'])/crop}")
-        cropstore_dst = zarr.DirectoryStore(
-            destination_path / dataname / (crop + ".zarr"),
-            dimension_separator="/",
-            normalize_keys=True,
+    logger.info(f"Copying crop {Path(crop_group)/crop}")
+    cropstore_dst = zarr.DirectoryStore(
+        destination_path / dataname / (crop + ".zarr"),
+        dimension_separator="/",
+        normalize_keys=True,
+    )
+    cropgroup_dst = zarr.open_group(cropstore_dst, "w")
+    cropgroup_src = zarr.open(Path(crop_group) / crop, "r")
+    labelgroup_dst = cropgroup_dst.create_group("labels")
+    labelgroup_dst.attrs.put(cropgroup_src.attrs.asdict())
+    for ds in cropgroup_src.keys():
+        ds_attrs = extract_single_scale_attrs(
+            cropgroup_src[ds].attrs.asdict(), "s0", "s0"
         )
-        cropgroup_dst = zarr.open_group(cropstore_dst, "w")
-        cropgroup_src = zarr.open(Path(datainfo["crop_group"]) / crop, "r")
-        labelgroup_dst = cropgroup_dst.create_group("labels")
-        labelgroup_dst.attrs.put(cropgroup_src.attrs.asdict())
-        for ds in cropgroup_src.keys():
-            ds_attrs = extract_single_scale_attrs(
-                cropgroup_src[ds].attrs.asdict(), "s0", "s0"
+        dsgroup_dst = labelgroup_dst.create_group(ds, overwrite=True)
+        dsgroup_dst.attrs.put(ds_attrs)
+        arr = cropgroup_src[ds]["s0"]
+        chunksize = (1, *arr.shape[1:])
+        if arr.chunks == chunksize and isinstance(arr.store, zarr.DirectoryStore):
+            dsgroupms_dst = dsgroup_dst.create_dataset(
+                "s0",
+                shape=arr.shape,
+                dtype=arr.dtype,
+                chunks=chunksize,
+                compressor=arr.compressor,
+                filters=arr.filters,
+                fill_value=arr.fill_value,
+                order=arr.order,
             )
-            dsgroup_dst = labelgroup_dst.create_group(ds, overwrite=True)
-            dsgroup_dst.attrs.put(ds_attrs)
-            arr = cropgroup_src[ds]["s0"]
-            chunksize = (1, *arr.shape[1:])
-            dsgroupms_dst = dsgroup_dst.create_dataset("s0", data=arr, chunks=chunksize)
-            dsgroupms_dst.attrs.put(cropgroup_src[ds]["s0"].attrs.asdict())
+            _copy_chunk_files(arr, dsgroupms_dst)
+        else:
+            dsgroupms_dst = dsgroup_dst.create_dataset(
+                "s0", shape=arr.shape, dtype=arr.dtype, chunks=chunksize
+            )
+            _stream_copy(arr, dsgroupms_dst)
+        dsgroupms_dst.attrs.put(cropgroup_src[ds]["s0"].attrs.asdict())
 
 
 def copy_crops_main(
@@ -89,18 +173,22 @@ def copy_crops_main(
         data_yaml (str): Path to data configuration yaml.
         destination (str): Path of parent directory for copy.
         max_concurrency (int, optional): Maximum number of concurrent processes. If
-            None, no limit is set. Defaults to None.
+            None, as many processes as there are CPUs are used. Defaults to None.
 
     """
-    loop = asyncio.get_event_loop()
-    task_list = []
-    with open(data_yaml) as f:
-        datasets = yaml.safe_load(f)["datasets"]
-        for dataname, datainfo in datasets.items():
-            task_list.append(_copy_cellmap_dataset(dataname, datainfo, destination))
-            if len(task_list) == max_concurrency:
-                looper = asyncio.gather(*task_list)
-                loop.run_until_complete(looper)
-                task_list = []
-    looper = asyncio.gather(*task_list)
-    loop.run_until_complete(looper)
+    datasets = load_data_yaml(data_yaml)["datasets"]
+    for dataname in datasets:
+        (Path(destination) / dataname).mkdir(exist_ok=True)
+    # copying is dominated by (de)compression, so crops are copied in separate
+    # processes rather than threads. Scheduling single crops keeps datasets with
+    # many crops from holding up the pool.
+    with ProcessPoolExecutor(max_workers=max_concurrency) as pool:
+        futures = [
+            pool.submit(
+                _copy_single_crop, dataname, crop, datainfo["crop_group"], destination
+            )
+            for dataname, datainfo in datasets.items()
+            for crop in datainfo["crops"]
+        ]
+        for future in as_completed(futures):
+            future.result()
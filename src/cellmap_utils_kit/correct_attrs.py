@@ -16,12 +16,16 @@ Dependencies:
 -------------
 - asyncio: For managing asynchronous processing of crops.
 - logging: For logging correction operations.
+- math: For rounding thresholds for integer labels.
+- os: For splitting the cores between concurrent corrections.
 - pathlib.Path: For handling file paths.
 - fibsem_tools (fst): A library for reading and accessing FIB-SEM data.
 - numpy (np): For performing numerical operations like element counts.
-- yaml: For reading the dataset configuration from a YAML file.
-- cellmap_utils_kit.parallel_utils: Provides the `background` decorator to run functions
-  asynchronously.
+- numba, numexpr (optional): For counting label values without temporary arrays.
+- h5py, zarr: For typing the label arrays that are counted chunk by chunk.
+- cellmap_utils_kit.misc_utils: For loading the data configuration yaml.
+- cellmap_utils_kit.parallel_utils: For running the corrections in a bounded process
+  pool.
 
 Usage:
 ------
@@ -40,18 +44,98 @@ correct_label_attrs_main("path/to/data_config.yaml")
 
 import asyncio
 import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import fibsem_tools as fst
+import h5py
 import numpy as np
-import yaml
+import zarr
 
-from cellmap_utils_kit.parallel_utils import background
+try:
+    import numba
+except ImportError:  # numba is optional, counting falls back to numexpr or numpy
+    numba = None
+try:
+    import numexpr
+except ImportError:  # numexpr is optional, counting falls back to numpy
+    numexpr = None
+
+from cellmap_utils_kit.misc_utils import load_data_yaml
+from cellmap_utils_kit.parallel_utils import gather_bounded
 
 logger = logging.getLogger(__name__)
 
 
-@background
+if numba is not None:
+
+    @numba.njit(parallel=True, cache=True)
+    def _count_slab(flat: np.ndarray, unknown: float, thr: float) -> tuple[int, int]:
+        num_unknown = 0
+        num_below_thr = 0
+        for i in numba.prange(flat.size):
+            v = flat[i]
+            if v == unknown:
+                num_unknown += 1
+            if v <= thr:
+                num_below_thr += 1
+        return num_unknown, num_below_thr
+
+elif numexpr is not None:
+
+    def _count_slab(flat: np.ndarray, unknown: float, thr: float) -> tuple[int, int]:
+        # numexpr fuses comparison and reduction, no boolean temporaries are created
+        local_dict = {"a": flat, "u": unknown, "t": thr}
+        return (
+            int(numexpr.evaluate("sum(where(a == u, 1, 0))", local_dict=local_dict)),
+            int(numexpr.evaluate("sum(where(a <= t, 1, 0))", local_dict=local_dict)),
+        )
+
+else:
+
+    def _count_slab(flat: np.ndarray, unknown: float, thr: float) -> tuple[int, int]:
+        return (
+            int(np.count_nonzero(flat == unknown)),
+            int(np.count_nonzero(flat <= thr)),
+        )
+
+
+def _to_label_dtype(
+    dtype: np.dtype, unknown: float, thr: float
+) -> tuple[float | np.integer, float | np.integer]:
+    # compare integer labels against scalars of their own dtype, so comparisons run on
+    # the narrow integer type instead of promoting every value to float64
+    if not np.issubdtype(dtype, np.integer):
+        return unknown, thr
+    info = np.iinfo(dtype)
+    if not float(unknown).is_integer() or not info.min <= unknown <= info.max:
+        return unknown, thr
+    if thr < info.min:
+        return unknown, thr
+    # for integers v <= thr is the same as v <= floor(thr)
+    return dtype.type(unknown), dtype.type(min(math.floor(thr), info.max))
+
+
+def _count_label_values(
+    src: zarr.Array | h5py.Dataset, unknown: float, thr: float
+) -> tuple[int, int]:
+    unknown, thr = _to_label_dtype(np.dtype(src.dtype), unknown, thr)
+    # stream the array in slabs of whole chunks along the first axis so each slab is
+    # only traversed while it's in memory and the full array is never materialized
+    step = src.chunks[0] if src.chunks is not None else src.shape[0]
+    num_unknown = 0
+    num_below_thr = 0
+    for start in range(0, src.shape[0], max(step, 1)):
+        slab_unknown, slab_below_thr = _count_slab(
+            np.ravel(src[start : start + step]), unknown, thr
+        )
+        num_unknown += int(slab_unknown)
+        num_below_thr += int(slab_below_thr)
+    return num_unknown, num_below_thr
+
+
 def _correct_label_attrs(crop_path: str | Path) -> None:
     crop = fst.access(crop_path, "a")
     if "labels" in crop:
@@ -59,27 +143,58 @@ def _correct_label_attrs(crop_path: str | Path) -> None:
     labels = crop.attrs["cellmap"]["annotation"]["class_names"]
     for label in labels:
         logger.info(f"Correcting attributes in {crop_path} for {label}")
-        for lvl in crop[label].keys():
-            src = crop[label][lvl]
-            srcarr = np.array(src)
+        label_grp = crop[label]
+        for lvl in label_grp.keys():
+            src = label_grp[lvl]
+            # read the attributes once, edit them in place and write them back once
             attrs_as_dict = src.attrs.asdict()
-            encoding = src.attrs["cellmap"]["annotation"]["annotation_type"]["encoding"]
-            num_unknown = np.sum(srcarr == encoding["unknown"])
+            annotation = attrs_as_dict["cellmap"]["annotation"]
+            encoding = annotation["annotation_type"]["encoding"]
             thr = abs(encoding["present"] - encoding["absent"]) / 2.0
+            num_unknown, num_below_thr = _count_label_values(
+                src, encoding["unknown"], thr
+            )
             if encoding["present"] > encoding["absent"]:
-                num_absent = np.sum(srcarr <= thr)
+                num_absent = num_below_thr
             else:
-                num_present = np.sum(srcarr <= thr)
-                num_absent = np.product(srcarr.shape - num_unknown - num_present)
-            attrs_as_dict["cellmap"]["annotation"]["complement_counts"]["absent"] = int(
-                num_absent
-            )
-            attrs_as_dict["cellmap"]["annotation"]["complement_counts"]["unknown"] = (
-                int(num_unknown)
-            )
+                num_present = num_below_thr
+                num_absent = src.size - num_unknown - num_present
+            annotation["complement_counts"]["absent"] = int(num_absent)
+            annotation["complement_counts"]["unknown"] = int(num_unknown)
             src.attrs.put(attrs_as_dict)
 
 
+def _limit_counting_threads(num_threads: int) -> None:
+    # numba's thread count is set per calling thread, counting runs in the worker
+    # process's main thread, which also runs this initializer
+    if numba is not None:
+        numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
+    if numexpr is not None:
+        numexpr.set_num_threads(num_threads)
+
+
+async def _correct_label_attrs_async_main(
+    crop_paths: list[Path], max_concurrency: None | int
+) -> None:
+    # crops are corrected in separate processes, as numba's parallel kernels must not
+    # be launched from several threads of one process at once (numba's workqueue
+    # threading layer isn't thread-safe). The cores are shared between concurrent
+    # crops instead of letting every crop's counting spawn a thread per core.
+    cpu_count = os.cpu_count() or 1
+    threads_per_task = max(1, cpu_count // (max_concurrency or cpu_count))
+    with ProcessPoolExecutor(
+        max_workers=max_concurrency,
+        initializer=_limit_counting_threads,
+        initargs=(threads_per_task,),
+    ) as pool:
+        await gather_bounded(
+            _correct_label_attrs,
+            ((crop_path,) for crop_path in crop_paths),
+            max_concurrency=max_concurrency,
+            executor=pool,
+        )
+
+
 def correct_label_attrs_main(
     data_yaml: str, max_concurrency: None | int = None
 ) -> None:
@@ -95,18 +210,10 @@ def correct_label_attrs_main(
             None, no limit is set. Defaults to None.
 
     """
-    loop = asyncio.get_event_loop()
-    task_list = []
-    with open(data_yaml) as f:
-        datasets = yaml.safe_load(f)["datasets"]
-        for datainfo in datasets.values():
-            for crop in datainfo["crops"]:
-                task_list.append(
-                    _correct_label_attrs(Path(datainfo["crop_group"]) / crop)
-                )
-                if len(task_list) == max_concurrency:
-                    looper = asyncio.gather(*task_list)
-                    loop.run_until_complete(looper)
-                    task_list = []
-    looper = asyncio.gather(*task_list)
-    loop.run_until_complete(looper)
+    datasets = load_data_yaml(data_yaml)["datasets"]
+    crop_paths = [
+        Path(datainfo["crop_group"]) / crop
+        for datainfo in datasets.values()
+        for crop in datainfo["crops"]
+    ]
+    asyncio.run(_correct_label_attrs_async_main(crop_paths, max_concurrency))
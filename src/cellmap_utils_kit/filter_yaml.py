@@ -10,20 +10,24 @@ Key Functions:
                     scale: None | Sequence[float] = None,
                     min_size: None | Sequence[int] = None,
                     min_frac_annotated: None | float = None,
-                    labels: Sequence[str] = ()) -> None
+                    labels: Sequence[str] = (),
+                    max_concurrency: None | int = None,
+                    *,
+                    consolidated: bool = False) -> None
     Filter a data configuration YAML file by removing crops that don't fulfill specified
     conditions and save as a new data configuration YAML.
 
 Dependencies:
 ------------
-- copy: Provides utilities for deep copying of data structures.
+- concurrent.futures, functools: For checking crops in a thread pool.
 - pathlib.Path: For handling file paths.
 - typing.Sequence: To annotate types for sequences.
 - fibsem_tools (fst): A library for interacting with FIB-SEM data formats.
-- numpy (np): Used for numerical calculations.
-- yaml: To read and write configuration files.
+- h5py, zarr: For typing opened crops.
 - cellmap_utils_kit.attribute_handler: Used for attribute manipulation of cellmap
   data.
+- cellmap_utils_kit.misc_utils: For loading and saving data configuration yamls and
+  reading consolidated metadata.
 
 Usage:
 ------
@@ -48,26 +52,53 @@ filter_yaml_main(
 
 """
 
-import copy
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Sequence
 
 import fibsem_tools as fst
-import numpy as np
-import yaml
+import h5py
+import zarr
 
 from cellmap_utils_kit.attribute_handler import access_attributes, get_scalelevel
+from cellmap_utils_kit.misc_utils import (
+    dump_data_yaml,
+    load_data_yaml,
+    open_consolidated,
+)
+
+
+def _get_crop_labels(
+    crop: h5py.Group | zarr.Group,
+) -> tuple[h5py.Group | zarr.Group, list[str]]:
+    labels_grp = crop["labels"]
+    class_names = access_attributes(labels_grp.attrs["cellmap"])["annotation"][
+        "class_names"
+    ]
+    return labels_grp, class_names
+
 
+def _open_crop_labels(
+    crop: str | Path | h5py.Group | zarr.Group,
+) -> tuple[h5py.Group | zarr.Group, list[str]]:
+    if isinstance(crop, (str, Path)):
+        crop = fst.read(crop)
+    return _get_crop_labels(crop)
 
-def check_res(crop_path: str | Path, check_scale: Sequence[float]) -> bool:
+
+def check_res(
+    crop: str | Path | h5py.Group | zarr.Group, check_scale: Sequence[float]
+) -> bool:
     """Check that crop is annotated at a specific scale.
 
     Check whether scale `check_scale` is contained in the multiscale pyramids of the
-    labels in the crop located at `crop_path`. Assumes that the scale levels are the
-    same for all labels (aka just checks for one).
+    labels in the crop `crop`. Assumes that the scale levels are the same for all
+    labels (aka just checks for one).
 
     Args:
-        crop_path (str | Path): path to the crop that should be checked
+        crop (str | Path | h5py.Group | zarr.Group): path to the crop that should be
+            checked or the already opened crop
         check_scale (Sequence[float]): scale to check for
 
     Returns:
@@ -75,29 +106,28 @@ def check_res(crop_path: str | Path, check_scale: Sequence[float]) -> bool:
             isn't
 
     """
-    crop = fst.read(crop_path)
-    ref_lbl = access_attributes(crop["labels"].attrs["cellmap"])["annotation"][
-        "class_names"
-    ][0]
+    labels_grp, class_names = _open_crop_labels(crop)
+    ref_lbl = class_names[0]
     try:
-        get_scalelevel(crop["labels"][ref_lbl], check_scale)
+        get_scalelevel(labels_grp[ref_lbl], check_scale)
     except ValueError:
         return False
     return True
 
 
 def check_min_size(
-    crop_path: str,
+    crop: str | Path | h5py.Group | zarr.Group,
     min_size: Sequence[int],
     at_scale: None | Sequence[float] = None,
 ) -> bool:
     """Check crop for minimum size.
 
-    Checks that the labels in the crop_path have at least size `min_size` at the scale
+    Checks that the labels in the crop `crop` have at least size `min_size` at the scale
     level with scale `at_scale`. If `at_scale` is None (default) it checks for "s0".
 
     Args:
-        crop_path (str): path to the crop that should be checked
+        crop (str | Path | h5py.Group | zarr.Group): path to the crop that should be
+            checked or the already opened crop
         min_size (Sequence[int]): minimum size of labels in that crop
         at_scale (None | Sequence[float], optional): scale for which size should be
             checked. If None checks at s0. Defaults to None.
@@ -107,15 +137,13 @@ def check_min_size(
             `min_size`. Otherwise False
 
     """
-    crop = fst.read(crop_path)
-    ref_lbl = access_attributes(crop["labels"].attrs["cellmap"])["annotation"][
-        "class_names"
-    ][0]
+    labels_grp, class_names = _open_crop_labels(crop)
+    ref_lbl = class_names[0]
     if at_scale is None:
         ref_scale = "s0"
     else:
-        ref_scale = get_scalelevel(crop["labels"][ref_lbl], at_scale)
-    ref_arr = fst.read(Path(crop_path) / "labels" / ref_lbl / ref_scale)
+        ref_scale = get_scalelevel(labels_grp[ref_lbl], at_scale)
+    ref_arr = labels_grp[ref_lbl][ref_scale]
     if all(sh >= min_sh for sh, min_sh in zip(ref_arr.shape, min_size)):
         return True
     else:
@@ -123,21 +151,22 @@ def check_min_size(
 
 
 def check_annotated_label(
-    crop_path: str,
+    crop: str | Path | h5py.Group | zarr.Group,
     label: str,
     min_frac_annotated: float,
     at_scale: None | Sequence[float] = None,
 ) -> bool:
     """Check that a minimum number of voxels in crop are annotated for the given label.
 
-    For the crop located at `crop_path` find the label array for class `label` and check
-    attributes for the fraction of annotated elements (not "unknown"). If at least
+    For the crop `crop` find the label array for class `label` and check attributes for
+    the fraction of annotated elements (not "unknown"). If at least
     `min_frac_annotated` are "present" or "absent" returns True. Otherwise
     returns False. The parameter `at_scale` controls which scale level to look at. If
     it is set to None "s0" will be used.
 
     Args:
-        crop_path (str): path to the crop that should be checked
+        crop (str | Path | h5py.Group | zarr.Group): path to the crop that should be
+            checked or the already opened crop
         label (str): name of the label that should be checked
         min_frac_annotated (float): minimum fraction of voxels that need to be annotated
             for crop to pass
@@ -157,26 +186,21 @@ def check_annotated_label(
             f"larger than 1: {min_frac_annotated}. Did you use percent?"
         )
         raise ValueError(msg)
-    crop = fst.read(crop_path)
-    if (
-        label
-        not in access_attributes(crop["labels"].attrs["cellmap"])["annotation"][
-            "class_names"
-        ]
-    ):
+    labels_grp, class_names = _open_crop_labels(crop)
+    if label not in class_names:
         return False
     if at_scale is None:
         ref_scale = "s0"
     else:
-        ref_scale = get_scalelevel(crop["labels"][label], at_scale)
-    ref_attrs = access_attributes(crop["labels"][label][ref_scale].attrs["cellmap"])[
-        "annotation"
-    ]
-    num_elements = np.prod(crop["labels"][label][ref_scale].shape).item()
-    if "unknown" in ref_attrs["complement_counts"]:
-        num_annotated = num_elements - ref_attrs["complement_counts"]["unknown"]
-    else:
-        num_annotated = num_elements
+        ref_scale = get_scalelevel(labels_grp[label], at_scale)
+    ref_arr = labels_grp[label][ref_scale]
+    ref_attrs = access_attributes(ref_arr.attrs["cellmap"])["annotation"]
+    num_unknown = ref_attrs["complement_counts"].get("unknown", 0)
+    # fully annotated crops pass any valid `min_frac_annotated`
+    if num_unknown == 0:
+        return True
+    num_elements = ref_arr.size
+    num_annotated = num_elements - num_unknown
     frac_annotated = num_annotated / num_elements
     if frac_annotated >= min_frac_annotated:
         return True
@@ -185,21 +209,22 @@ def check_annotated_label(
 
 
 def check_annotated(
-    crop_path: str,
+    crop: str | Path | h5py.Group | zarr.Group,
     labels: Sequence[str],
     min_frac_annotated: float,
     at_scale: None | Sequence[float] = None,
 ) -> bool:
     """Check that a minimum number of voxels in crop are annotated for all given labels.
 
-    For the crop located at `crop_path` find each of the label arrays in `labels` and
-    check their attributes for the fraction of annotated elements (not "unknown"). If at
-    least `min_frac_annotated` are "present" or "absent" for every label return True.
+    For the crop `crop` find each of the label arrays in `labels` and check their
+    attributes for the fraction of annotated elements (not "unknown"). If at least
+    `min_frac_annotated` are "present" or "absent" for every label return True.
     Otherwise return False. The parameter `at_scale` controls which scale level to look
     at. If it is None, "s0" will be used.
 
     Args:
-        crop_path (str): path to the crop that should be checked
+        crop (str | Path | h5py.Group | zarr.Group): path to the crop that should be
+            checked or the already opened crop
         labels (Sequence[str]): names of all the labels that should be checked
         min_frac_annotated (float): minimum fraction of voxels that need to be annotated
             in each label array for crop to pass
@@ -213,14 +238,17 @@ def check_annotated(
     """
     for label in labels:
         if not check_annotated_label(
-            crop_path, label, min_frac_annotated, at_scale=at_scale
+            crop,
+            label,
+            min_frac_annotated,
+            at_scale=at_scale,
         ):
             return False
     return True
 
 
 def filter_crop(
-    crop_path: str,
+    crop_path: str | Path | h5py.Group | zarr.Group,
     scale: None | Sequence[float] = None,
     min_size: None | Sequence[int] = None,
     min_frac_annotated: None | float = None,
@@ -235,7 +263,8 @@ def filter_crop(
     to None remaining checks will be done at scale level "s0".
 
     Args:
-        crop_path (str): path to the crop that should be checked
+        crop_path (str | Path | h5py.Group | zarr.Group): path to the crop that should
+            be checked or the already opened crop
         scale (None | Sequence[float], optional): scale to check for and that should be
             used for size and annotation checks. If None, the crop will not be checked
             for the existence of a specific scale and other checks will be done at full
@@ -253,18 +282,29 @@ def filter_crop(
         bool: True if all checks passed. If any of them fail False.
 
     """
+    # the crop is opened once and the handle is shared between all checks
+    if isinstance(crop_path, (str, Path)):
+        crop = fst.read(crop_path)
+    else:
+        crop = crop_path
     keep_crop = True
     if keep_crop and scale is not None:
-        keep_crop = check_res(crop_path, scale)
+        keep_crop = check_res(crop, scale)
     if keep_crop and min_size is not None:
-        keep_crop = check_min_size(crop_path, min_size, at_scale=scale)
+        keep_crop = check_min_size(crop, min_size, at_scale=scale)
     if keep_crop and min_frac_annotated is not None:
-        keep_crop = check_annotated(
-            crop_path, labels, min_frac_annotated, at_scale=scale
-        )
+        keep_crop = check_annotated(crop, labels, min_frac_annotated, at_scale=scale)
     return keep_crop
 
 
+def _get_crop(
+    crop_group: str, crop: str, consolidated_group: zarr.Group | None
+) -> Path | zarr.Group:
+    if consolidated_group is None or crop not in consolidated_group:
+        return Path(crop_group) / crop
+    return consolidated_group[crop]
+
+
 def filter_yaml_main(
     data_yaml: str,
     data_yaml_filtered: str,
@@ -272,6 +312,9 @@ def filter_yaml_main(
     min_size: None | Sequence[int] = None,
     min_frac_annotated: None | float = None,
     labels: Sequence[str] = (),
+    max_concurrency: None | int = None,
+    *,
+    consolidated: bool = False,
 ) -> None:
     """Make new data config yaml with crops removed that don't fulfill conditions.
 
@@ -294,26 +337,61 @@ def filter_yaml_main(
             Defaults to None.
         labels (Sequence[str], optional): Labels for which to check annotated fraction.
             Defaults to ().
+        max_concurrency (int, optional): Maximum number of crops that are checked
+            concurrently. If None, the default of `ThreadPoolExecutor` is used.
+            Defaults to None.
+        consolidated (bool, optional): If True, read the metadata of each crop group
+            from its existing consolidated metadata. Crop groups without consolidated
+            metadata are read as usual, none is written. Consolidated metadata is not
+            updated when crops change (e.g. by `correct_label_attrs_main`), so only
+            use this if it is current. Defaults to False.
 
     """
-    with open(data_yaml) as f:
-        data_config = yaml.safe_load(f)
-        data_config_filtered = copy.deepcopy(data_config)
-        datasets = data_config["datasets"]
-        for dataname, datainfo in datasets.items():
-            crops_filtered = []
-            for crop in datainfo["crops"]:
-                if filter_crop(
-                    Path(datainfo["crop_group"]) / crop,
-                    scale=scale,
-                    min_size=min_size,
-                    min_frac_annotated=min_frac_annotated,
-                    labels=labels,
-                ):
-                    crops_filtered.append(crop)
-            if len(crops_filtered) > 0:
-                data_config_filtered["datasets"][dataname]["crops"] = crops_filtered
-            else:
-                del data_config_filtered["datasets"][dataname]
-    with open(data_yaml_filtered, "w") as f:
-        yaml.safe_dump(data_config_filtered, f)
+    data_config = load_data_yaml(data_yaml)
+    # only the crop lists change, so everything else can be shared with the input
+    data_config_filtered = {k: v for k, v in data_config.items() if k != "datasets"}
+    data_config_filtered["datasets"] = {}
+    datasets = data_config["datasets"]
+    consolidated_groups = {}
+    if consolidated:
+        for datainfo in datasets.values():
+            crop_group = datainfo["crop_group"]
+            if crop_group not in consolidated_groups:
+                consolidated_groups[crop_group] = open_consolidated(crop_group)
+    jobs = [
+        (
+            dataname,
+            crop,
+            _get_crop(
+                datainfo["crop_group"],
+                crop,
+                consolidated_groups.get(datainfo["crop_group"]),
+            ),
+        )
+        for dataname, datainfo in datasets.items()
+        for crop in datainfo["crops"]
+    ]
+    # checks only read metadata, so they're I/O bound and can run in threads
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        keep = pool.map(
+            functools.partial(
+                filter_crop,
+                scale=scale,
+                min_size=min_size,
+                min_frac_annotated=min_frac_annotated,
+                labels=labels,
+            ),
+            [crop_path for _, _, crop_path in jobs],
+        )
+        crops_kept: dict[str, list[str]] = {dataname: [] for dataname in datasets}
+        for (dataname, crop, _), keep_crop in zip(jobs, keep):
+            if keep_crop:
+                crops_kept[dataname].append(crop)
+    for dataname, datainfo in datasets.items():
+        crops_filtered = crops_kept[dataname]
+        if len(crops_filtered) > 0:
+            data_config_filtered["datasets"][dataname] = {
+                **datainfo,
+                "crops": crops_filtered,
+            }
+    dump_data_yaml(data_config_filtered, data_yaml_filtered)
@@ -2,9 +2,9 @@
 Module for exporting Zarr datasets to HDF5 format.
 
 This module provides functionality to copy Zarr datasets into HDF5 files while
-maintaining the original structure and converting attributes to JSON strings. The
-export process is asynchronous, allowing for concurrent processing of multiple crops
-to enhance performance.
+maintaining the original structure and converting nested attributes to JSON strings.
+Crops are exported in a process pool, allowing for concurrent processing of multiple
+crops to enhance performance.
 
 Key Functions:
 -------------
@@ -15,16 +15,23 @@ Key Functions:
 
 Dependencies:
 ------------
-- asyncio: For asynchronous programming.
+- collections: For queueing superchunks that have been read ahead.
+- concurrent.futures: For exporting crops in a process pool and reading ahead.
 - h5py: For reading and writing HDF5 files.
-- json: For handling JSON data.
+- hdf5plugin (optional): For compressing the HDF5 datasets with blosc.
+- itertools: For iterating over all superchunks.
+- json: For encoding nested attributes as JSON strings.
 - logging: For logging messages and errors.
+- math: For sizing the hdf5 chunks.
+- multiprocessing: For handing out cpus to the export processes.
+- os: For pinning the export processes.
+- numcodecs: For recognizing blosc compressed zarr chunks and limiting blosc's
+  threads.
 - numpy: For numerical operations and array handling.
 - pathlib: For manipulating filesystem paths.
-- yaml: For reading configuration files in YAML format.
 - zarr: For accessing and manipulating Zarr datasets.
-- cellmap_utils_kit.misc_utils: For utility functions like `extract_crop_name`.
-- cellmap_utils_kit.parallel_utils: For managing background tasks.
+- cellmap_utils_kit.misc_utils: For utility functions like `extract_crop_name`,
+  `load_data_yaml` and `open_consolidated`.
 
 Usage:
 -----
@@ -41,102 +48,323 @@ h5_export_main("path/to/config.yaml", "output/directory", concurrence=4)
 
 """
 
-import asyncio
+import itertools
 import json
 import logging
+import math
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from multiprocessing.sharedctypes import Synchronized
 from pathlib import Path
+from typing import Any
 
 import h5py
 import numpy as np
-import yaml
 import zarr
+from numcodecs import Blosc, blosc
 
-from cellmap_utils_kit.misc_utils import extract_crop_name
-from cellmap_utils_kit.parallel_utils import background
+try:
+    import hdf5plugin
+except ImportError:  # hdf5plugin is optional, compression falls back to gzip
+    hdf5plugin = None
+
+from cellmap_utils_kit.misc_utils import (
+    extract_crop_name,
+    load_data_yaml,
+    open_consolidated,
+)
 
 logger = logging.getLogger(__name__)
 
+# number of threads reading zarr superchunks per dataset and number of superchunks
+# that are read ahead of the hdf5 writer
+_READ_THREADS = 4
+_PREFETCH_DEPTH = 8
+# zarr chunks smaller than _MIN_CHUNK_BYTES are grown to about _TARGET_CHUNK_BYTES for
+# the hdf5 export
+_MIN_CHUNK_BYTES = 1 << 16
+_TARGET_CHUNK_BYTES = 1 << 18
+# blosc with zstd and bitshuffle compresses label volumes well at little cost, gzip is
+# built into every hdf5 installation
+if hdf5plugin is not None:
+    _H5_COMPRESSION = dict(
+        hdf5plugin.Blosc(cname="zstd", clevel=3, shuffle=hdf5plugin.Blosc.BITSHUFFLE)
+    )
+else:
+    _H5_COMPRESSION = {"compression": "gzip", "compression_opts": 1, "shuffle": True}
+# the latest file format stores attributes of groups with many attributes densely, a
+# large chunk cache avoids evicting partially written chunks and paged file space
+# management keeps the many small group and attribute objects from fragmenting the file
+_H5_FILE_OPTIONS = {
+    "libver": "latest",
+    "rdcc_nbytes": 256 * 1024 * 1024,
+    "rdcc_nslots": 1_000_003,
+    "rdcc_w0": 0.75,
+    "fs_strategy": "page",
+    "fs_page_size": 64 * 1024,
+}
+# crops that are smaller than _CORE_DRIVER_MAX_BYTES (uncompressed) are assembled in
+# memory and written to disk in one go when the file is closed
+_CORE_DRIVER_MAX_BYTES = 512 * 1024 * 1024
+_H5_CORE_DRIVER_OPTIONS = {
+    "driver": "core",
+    "backing_store": True,
+    "block_size": 64 * 1024 * 1024,
+}
+
 
-def _copy_data(zfh: zarr.Group, h5fh: h5py.Group | h5py.File, dataset: str) -> None:
-    zarr_dset = zfh[dataset]
-    chunks = tuple(min(8, sh) for sh in zarr_dset.shape)
-    h5_dset = h5fh.create_dataset(
-        dataset, shape=zarr_dset.shape, chunks=chunks, dtype=zarr_dset.dtype
+def _read_superchunk(
+    zarr_dset: zarr.Array, superchunk_slices: tuple[slice, ...], buf: np.ndarray
+) -> tuple[slice, ...]:
+    buf_slices = tuple(slice(0, sl.stop - sl.start) for sl in superchunk_slices)
+    zarr_dset.get_basic_selection(superchunk_slices, out=buf[buf_slices])
+    return buf_slices
+
+
+def _write_superchunk(
+    h5_dset: h5py.Dataset,
+    buf: np.ndarray,
+    superchunk_slices: tuple[slice, ...],
+    read: Future,
+) -> None:
+    h5_dset.write_direct(buf, source_sel=read.result(), dest_sel=superchunk_slices)
+
+
+def _create_attribute(attrs: h5py.AttributeManager, key: str, attr: Any) -> None:
+    # numbers and flat lists of numbers are stored as native hdf5 attributes, anything
+    # else (e.g. the nested OME-NGFF metadata) is encoded as a json string
+    if isinstance(attr, (bool, int, float)) or (
+        isinstance(attr, list)
+        and attr
+        and all(isinstance(a, (bool, int, float)) for a in attr)
+    ):
+        native = np.asarray(attr)
+        if native.dtype.kind in "biuf":
+            attrs.create(key, native)
+            return
+    attrs.create(key, json.dumps(attr))
+
+
+def _get_h5_chunks(zarr_dset: zarr.Array) -> tuple[int, ...]:
+    # hdf5 chunks follow the zarr chunks, but chunks that are too small bloat the
+    # chunk index, so those are scaled up along all axes
+    chunk_bytes = math.prod(zarr_dset.chunks) * zarr_dset.dtype.itemsize
+    if chunk_bytes >= _MIN_CHUNK_BYTES:
+        scale = 1
+    else:
+        scale = math.ceil((_TARGET_CHUNK_BYTES / chunk_bytes) ** (1 / zarr_dset.ndim))
+    return tuple(min(c * scale, sh) for c, sh in zip(zarr_dset.chunks, zarr_dset.shape))
+
+
+def _is_chunk_transferable(zarr_dset: zarr.Array, chunks: tuple[int, ...]) -> bool:
+    # blosc compressed zarr chunks are valid chunks for hdf5's blosc filter, as long as
+    # they cover the same region and don't need any other filter
+    return (
+        hdf5plugin is not None
+        and isinstance(zarr_dset.compressor, Blosc)
+        and not zarr_dset.filters
+        and zarr_dset.order == "C"
+        and zarr_dset.chunks == chunks
     )
 
-    superchunks = (chunks[0],) + zarr_dset.chunks[1:]
 
-    # Calculate the number of superchunks along each dimension
-    num_superchunks = [
-        int(np.ceil(s / c)) for s, c in zip(zarr_dset.shape, superchunks)
+def _transfer_chunks(zarr_dset: zarr.Array, h5_dset: h5py.Dataset) -> None:
+    # chunk bytes are copied without decompressing them, missing zarr chunks stay
+    # missing (i.e. fillvalue) in hdf5 as well
+    num_chunks = [math.ceil(s / c) for s, c in zip(zarr_dset.shape, zarr_dset.chunks)]
+    for chunk_idx in itertools.product(*(range(n) for n in num_chunks)):
+        key = zarr_dset._chunk_key(chunk_idx)
+        if key in zarr_dset.chunk_store:
+            offset = tuple(i * c for i, c in zip(chunk_idx, zarr_dset.chunks))
+            h5_dset.id.write_direct_chunk(offset, zarr_dset.chunk_store[key])
+
+
+def _stream_superchunks(
+    zarr_dset: zarr.Array, h5_dset: h5py.Dataset, chunks: tuple[int, ...]
+) -> None:
+    # superchunks span whole zarr chunks and whole hdf5 chunks, so every zarr chunk is
+    # decompressed exactly once and every hdf5 chunk is written exactly once
+    superchunks = tuple(
+        min(int(np.lcm(zc, hc)), sh)
+        for zc, hc, sh in zip(zarr_dset.chunks, chunks, zarr_dset.shape)
+    )
+
+    # the superchunk slices along each dimension, all superchunks are their product
+    axis_slices = [
+        [slice(start, min(start + c, s)) for start in range(0, s, c)]
+        for s, c in zip(zarr_dset.shape, superchunks)
     ]
-    # Iterate over all superchunk indices
-    for chunk_idx in np.ndindex(*num_superchunks):
-        # construct indexing
-        superchunk_slices = (
-            slice(ch_idx * ch_size, min((ch_idx + 1) * ch_size, arr_sh))
-            for ch_idx, ch_size, arr_sh in zip(chunk_idx, superchunks, zarr_dset.shape)
-        )
+    # a small ring of buffers is reused for all superchunks, superchunks at the upper
+    # edges only use part of their buffer
+    buffers = [
+        np.empty(superchunks, dtype=zarr_dset.dtype) for _ in range(_PREFETCH_DEPTH)
+    ]
+    # reading (and decompressing) zarr chunks releases the GIL, so upcoming
+    # superchunks are read in a thread pool while the hdf5 writes happen in order here
+    pending: deque[tuple[np.ndarray, tuple[slice, ...], Future]] = deque()
+    with ThreadPoolExecutor(max_workers=_READ_THREADS) as pool:
+        for n, superchunk_slices in enumerate(itertools.product(*axis_slices)):
+            if len(pending) == _PREFETCH_DEPTH:
+                _write_superchunk(h5_dset, *pending.popleft())
+            # the buffer was freed by the write of the superchunk _PREFETCH_DEPTH back
+            buf = buffers[n % _PREFETCH_DEPTH]
+            future = pool.submit(_read_superchunk, zarr_dset, superchunk_slices, buf)
+            pending.append((buf, superchunk_slices, future))
+        while pending:
+            _write_superchunk(h5_dset, *pending.popleft())
+
 
-        # copy superchunk
-        h5_dset[superchunk_slices] = zarr_dset[superchunk_slices]
+def _copy_data(
+    zarr_dset: zarr.Array, h5fh: h5py.Group | h5py.File, dataset: str
+) -> None:
+    chunks = _get_h5_chunks(zarr_dset)
+    transferable = _is_chunk_transferable(zarr_dset, chunks)
+    compression = dict(hdf5plugin.Blosc()) if transferable else _H5_COMPRESSION
+    h5_dset = h5fh.create_dataset(
+        dataset,
+        shape=zarr_dset.shape,
+        chunks=chunks,
+        dtype=zarr_dset.dtype,
+        fillvalue=zarr_dset.fill_value,
+        **compression,
+    )
+    if transferable:
+        _transfer_chunks(zarr_dset, h5_dset)
+    else:
+        _stream_superchunks(zarr_dset, h5_dset, chunks)
 
     for k, attr in zarr_dset.attrs.asdict().items():
-        h5fh.attrs.create(k, json.dumps(attr))
+        _create_attribute(h5_dset.attrs, k, attr)
 
 
-def _copy_group(zfh: zarr.Group, h5fh: h5py.Group | h5py.File, group: str) -> None:
+def _copy_group_attributes(zgrp: zarr.Group, h5fh: h5py.File, group: str) -> None:
     logger.debug(f"Copy group {group}")
-    h5fhg = h5fh.create_group(group)
-    for k, attr in zfh[group].attrs.asdict().items():
-        h5fhg.attrs.create(k, json.dumps(attr))
-    for el in zfh[group].keys():
-        logger.debug(f"Processing {group}'s {el}")
-        if isinstance(zfh[group][el], zarr.Group):
-            _copy_group(zfh[group], h5fhg, el)
-        else:
-            _copy_data(zfh[group], h5fhg, el)
-
-
-@background
-def _export_crop(src_crop_path: str, destination: str, dataname: str) -> None:
+    h5fhg = h5fh.require_group(group)
+    for k, attr in zgrp.attrs.asdict().items():
+        _create_attribute(h5fhg.attrs, k, attr)
+
+
+def _get_crop_size(crop_path: str) -> int:
+    # uncompressed bytes of all arrays as a proxy for how long a crop takes to export,
+    # only the metadata is read
+    nodes: list[zarr.Group | zarr.Array] = []
+    zarr.open(crop_path, "r").visitvalues(nodes.append)
+    return sum(node.nbytes for node in nodes if isinstance(node, zarr.Array))
+
+
+def _init_export_worker(num_workers: int, worker_counter: Synchronized) -> None:
+    # each worker gets its own share of the cpus for blosc's threads and, where
+    # supported, is pinned to it, so the decompression threads of different crops
+    # don't compete for the same cores
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    cpus_per_worker = len(cpus) // num_workers
+    blosc.set_nthreads(max(1, cpus_per_worker))
+    if cpus_per_worker == 0 or not hasattr(os, "sched_setaffinity"):
+        return
+    with worker_counter.get_lock():
+        worker_idx = worker_counter.value % num_workers
+        worker_counter.value += 1
+    start = worker_idx * cpus_per_worker
+    os.sched_setaffinity(0, cpus[start : start + cpus_per_worker])
+
+
+def _export_crop(
+    src_crop_path: str, destination: str, dataname: str, *, consolidated: bool = False
+) -> None:
     logger.info(src_crop_path)
     cropname = extract_crop_name(src_crop_path)
-    h5f = h5py.File(Path(destination) / dataname / f"{cropname}.h5", "w")
-    zf = zarr.open(src_crop_path, "r")
-    for group in zf.keys():
-        _copy_group(zf, h5f, group)
+    zf = open_consolidated(src_crop_path) if consolidated else None
+    if zf is None:
+        zf = zarr.open(src_crop_path, "r")
+    nodes: list[tuple[str, zarr.Group | zarr.Array]] = []
+    zf.visititems(lambda name, node: nodes.append((name, node)))
+    arrays = [(name, node) for name, node in nodes if isinstance(node, zarr.Array)]
+    file_options = _H5_FILE_OPTIONS
+    if sum(zarr_dset.nbytes for _, zarr_dset in arrays) < _CORE_DRIVER_MAX_BYTES:
+        file_options = {**file_options, **_H5_CORE_DRIVER_OPTIONS}
+    h5f = h5py.File(
+        Path(destination) / dataname / f"{cropname}.h5", "w", **file_options
+    )
+    # the whole hierarchy is created first and the data is streamed afterwards, the
+    # crop's root attributes are not copied
+    for name, node in nodes:
+        if isinstance(node, zarr.Group):
+            _copy_group_attributes(node, h5f, name)
+    for name, zarr_dset in arrays:
+        logger.debug(f"Copy array {name}")
+        parent, _, dataset = name.rpartition("/")
+        _copy_data(zarr_dset, h5f[parent] if parent else h5f, dataset)
     h5f.close()
 
 
 def h5_export_main(
-    data_yaml: str, destination: str, max_concurrency: int | None = None
+    data_yaml: str,
+    destination: str,
+    max_concurrency: int | None = None,
+    *,
+    consolidated: bool = False,
 ) -> None:
-    """Copy zarr data to h5 and rechunk to (8,8,8).
+    """Copy zarr data to h5, chunked like the zarr data.
 
     This function resaves zarrs specified in a data configuration yaml to a new
     directory as hdf5 files. The structure within the hdf5 files follows that of the
-    zarr files. Attributes are encoded as json strings.
+    zarr files. The hdf5 datasets use the chunks of the zarr arrays, chunks smaller
+    than 64 KiB are scaled up to about 256 KiB. Numeric attributes are stored
+    natively, all other attributes are encoded as json strings. Datasets are compressed
+    with blosc (zstd, bitshuffle) if hdf5plugin is installed and with gzip otherwise.
 
     Args:
         data_yaml (str): Path to data configuration yaml with zarrs.
         destination (str): Path to destination directory
         max_concurrency (int, optional): Maximum number of concurrent processes. If
-            None, no limit is set. Defaults to None.
+            None, as many processes as there are CPUs are used. Defaults to None.
+        consolidated (bool, optional): If True, read the metadata of each crop from its
+            existing consolidated metadata. Crops without consolidated metadata are
+            read as usual, none is written. Consolidated metadata is not updated when
+            crops change (e.g. by correcting attributes or adding scale levels), so
+            the export would miss those changes. Only use this if it is current.
+            Defaults to False.
 
     """
-    loop = asyncio.get_event_loop()
-    task_list = []
-    with open(data_yaml) as f:
-        datasets = yaml.safe_load(f)["datasets"]
-        for dataname, datainfo in datasets.items():
-            (Path(destination) / dataname).mkdir(exist_ok=True)
-            for crop in datainfo["crops"]:
-                crop_path = str(Path(datainfo["crop_group"]) / crop)
-                task_list.append(_export_crop(crop_path, destination, dataname))
-                if len(task_list) == max_concurrency:
-                    looper = asyncio.gather(*task_list)
-                    loop.run_until_complete(looper)
-                    task_list = []
-    looper = asyncio.gather(*task_list)
-    loop.run_until_complete(looper)
+    datasets = load_data_yaml(data_yaml)["datasets"]
+    for dataname in datasets:
+        (Path(destination) / dataname).mkdir(exist_ok=True)
+    # h5py serializes on a global lock and decompressing zarr chunks holds the GIL,
+    # so crops are exported in separate processes. Each crop is written to its own
+    # hdf5 file, so the processes don't share any handles.
+    crops = [
+        (str(Path(datainfo["crop_group"]) / crop), dataname)
+        for dataname, datainfo in datasets.items()
+        for crop in datainfo["crops"]
+    ]
+    # the largest crops are started first and the small ones fill up the pool at the
+    # end, so no large crop is left running on its own
+    crops.sort(key=lambda crop: _get_crop_size(crop[0]), reverse=True)
+    num_workers = max_concurrency or os.cpu_count() or 1
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        initializer=_init_export_worker,
+        initargs=(num_workers, multiprocessing.Value("i", 0)),
+    ) as pool:
+        futures = [
+            pool.submit(
+                _export_crop,
+                crop_path,
+                destination,
+                dataname,
+                consolidated=consolidated,
+            )
+            for crop_path, dataname in crops
+        ]
+        for future in as_completed(futures):
+            future.result()
@@ -11,7 +11,10 @@ Key Functions:
     datasets.
 """
 
+import functools
 import json
+import math
+import os
 from collections.abc import Hashable
 from dataclasses import dataclass
 from pathlib import Path
@@ -21,6 +24,7 @@ import dask.array as da
 import h5py
 import numpy as np
 from dask.array.core import Array as DaskArray
+from dask.array.core import getter
 from dask.base import tokenize
 from datatree import DataTree
 from fibsem_tools import read, read_xarray
@@ -35,6 +39,70 @@ from xarray import DataArray, Dataset
 from xarray_ome_ngff.array_wrap import BaseArrayWrapper
 from xarray_ome_ngff.v04.multiscale import coords_from_transforms, normalize_transforms
 
+try:
+    # registers the blosc filter used by the hdf5 export
+    import hdf5plugin  # noqa: F401
+except ImportError:
+    pass
+try:
+    import orjson
+except ImportError:  # orjson is optional, attributes are decoded with json instead
+    orjson = None
+
+if orjson is None:
+    _json_loads = json.loads
+else:
+
+    def _json_loads(value: str | bytes) -> Any:
+        try:
+            return orjson.loads(value)
+        except orjson.JSONDecodeError:
+            # json.dumps writes NaN and (-)Infinity, which orjson rejects
+            return json.loads(value)
+
+
+# default target size of dask chunks for chunks="aggregate"
+_DASK_CHUNK_BYTES = 100 * 1024 * 1024
+# HDF5's default raw data chunk cache size per dataset
+_H5_DEFAULT_CACHE_BYTES = 1024 * 1024
+# smallest hdf5 chunk size the chunk cache's hash table is sized for
+_H5_MIN_CHUNK_BYTES = 64 * 1024
+# file extensions of hdf5 files, paths into a file continue after the file name
+_H5_SUFFIXES = (".h5", ".hdf5", ".hdf")
+
+
+def _decode_hdf_attribute(value: Any) -> Any:
+    # nested attributes are stored as json strings, numbers and lists of numbers as
+    # native hdf5 attributes
+    if isinstance(value, (str, bytes)):
+        return _json_loads(value)
+    return value.tolist()
+
+
+def _decode_hdf_attributes(node: h5py.Group) -> dict[str, Any]:
+    # all values are read from the file first, then decoded in one go
+    raw = dict(node.attrs.items())
+    return {key: _decode_hdf_attribute(value) for key, value in raw.items()}
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_multiscales(multiscales: str) -> MultiscaleGroupAttrs:
+    # keyed by the json string itself, so all scale levels of a group (and groups with
+    # identical metadata) share one parsed and validated instance, which therefore
+    # must not be modified
+    return MultiscaleGroupAttrs(multiscales=_json_loads(multiscales))
+
+
+@functools.lru_cache(maxsize=256)
+def _index_multiscales(multiscales: str) -> dict[str, tuple[Any, Any]]:
+    # maps dataset paths to their multiscale and dataset metadata, the first
+    # multiscale that lists a path wins
+    index: dict[str, tuple[Any, Any]] = {}
+    for multi in _parse_multiscales(multiscales).multiscales:
+        for dset in multi.datasets:
+            index.setdefault(dset.path, (multi, dset))
+    return index
+
 
 # adapted from pydantic_zarr.v2.GroupSpec
 class HDFGroupSpec(GroupSpec):
@@ -48,11 +116,11 @@ class HDFGroupSpec(GroupSpec):
         `ArraySpec`, respectively, and these spec instances will be stored in the
         `members` attribute of the parent `GroupSpec`.
 
-        This is a recursive function, and the depth of the recursion can be controlled
-        by the `depth` keyword argument. The default value for `depth` is -`, which
-        directs this function to traverse the entirety of a `zarr.Group`. This may be
-        slow for large hierarchies, in which case setting `depth` to a positive integer
-        can limit how deep into the hierarchy the recursion goes.
+        The hierarchy is traversed depth-first, and the depth of the traversal can be
+        controlled by the `depth` keyword argument. The default value for `depth` is -1,
+        which directs this function to traverse the entirety of a `h5py.Group`. This may
+        be slow for large hierarchies, in which case setting `depth` to a positive
+        integer can limit how deep into the hierarchy the traversal goes.
 
         Args:
             group (h5py.Group): The HDF5 Group to model.
@@ -68,33 +136,47 @@ class HDFGroupSpec(GroupSpec):
                 hierarchy.
 
         """
-        attributes = {}
-        for key, value in group.attrs.items():
-            attributes[key] = json.loads(value)
-        members = {}
-        if depth == 0:
-            return cls(attributes=attributes, members=None)
         if depth < -1:
             msg = (
                 f"Invalid value for depth. Got {depth}, expected an integer "
                 "greater than or equal to -1."
             )
             raise ValueError(msg)
-        new_depth = max(depth - 1, -1)
-        for name, item in group.items():
-            if isinstance(item, h5py.Dataset):
-                item_out = ArraySpec.from_array(item).model_dump()
-            elif isinstance(item, h5py.Group):
-                item_out = HDFGroupSpec.from_hdf(item, depth=new_depth).model_dump()
-            else:
-                msg = (
-                    f"Unparseable object encountered: {type(item)}. Expected "
-                    "`h5py.Dataset` or `h5py.Group`."
-                )
-                raise ValueError(msg)
-            members[name] = item_out
-        result = cls(attributes=attributes, members=members)
-        return result
+        # groups are collected depth-first with an explicit stack and their specs are
+        # built in reverse order, i.e. every group after all of its subgroups
+        nodes: list[tuple[h5py.Group, dict | None, dict | None, str]] = []
+        stack: list[tuple[h5py.Group, int, dict | None, str]] = [
+            (group, depth, None, "")
+        ]
+        while stack:
+            grp, grp_depth, parent_members, name = stack.pop()
+            members: dict | None = None if grp_depth == 0 else {}
+            nodes.append((grp, members, parent_members, name))
+            if members is None:
+                continue
+            new_depth = max(grp_depth - 1, -1)
+            for child_name, item in grp.items():
+                if isinstance(item, h5py.Dataset):
+                    members[child_name] = ArraySpec.from_array(item)
+                elif isinstance(item, h5py.Group):
+                    # placeholder that keeps the order of members
+                    members[child_name] = None
+                    stack.append((item, new_depth, members, child_name))
+                else:
+                    msg = (
+                        f"Unparseable object encountered: {type(item)}. Expected "
+                        "`h5py.Dataset` or `h5py.Group`."
+                    )
+                    raise ValueError(msg)
+        # attributes are decoded json and members are spec instances built right here,
+        # so the models are constructed without running pydantic's validation
+        for grp, members, parent_members, name in reversed(nodes[1:]):
+            parent_members[name] = HDFGroupSpec.model_construct(
+                attributes=_decode_hdf_attributes(grp), members=members
+            )
+        return cls.model_construct(
+            attributes=_decode_hdf_attributes(group), members=nodes[0][1]
+        )
 
 
 # adapted form pydantic_ome_ngff.v04.multiscale.MultiscaleGroup
@@ -128,20 +210,20 @@ class HDFMultiscaleGroup(MultiscaleGroup, HDFGroupSpec):
 
         """
         guess = HDFGroupSpec.from_hdf(node, depth=0)
-        multi_meta = MultiscaleGroupAttrs(
-            multiscales=json.loads(node.attrs["multiscales"])
-        )
+        multi_meta = MultiscaleGroupAttrs(multiscales=guess.attributes["multiscales"])
         members_tree_flat = {}
         for multiscale in multi_meta.multiscales:
             for dataset in multiscale.datasets:
-                array = node[dataset.path]
-                array_spec = ArraySpec.from_array(array)
-                members_tree_flat["/" + dataset.path] = array_spec
+                key = "/" + dataset.path
+                # multiscales may share datasets, those are only modeled once
+                if key not in members_tree_flat:
+                    members_tree_flat[key] = ArraySpec.from_array(node[dataset.path])
         members_normalized = GroupSpec.from_flat(members_tree_flat)
-        guess_inferred_members = guess.model_copy(
-            update={"members": members_normalized.members}
-        )
-        return cls(**guess_inferred_members.model_dump())
+        return cls(attributes=guess.attributes, members=members_normalized.members)
+
+
+def _is_h5_path(path: str | Path) -> bool:
+    return any(part.endswith(_H5_SUFFIXES) for part in str(path).split("/"))
 
 
 def read_any_xarray(
@@ -157,7 +239,9 @@ def read_any_xarray(
     """Extension of fibsem_tools.read_xarray that can also interpret hdf5 data.
 
     For HDF5 data the OME-NGFF metadata is used but encoded as a single json string in
-    the HDF5 dataset's `multiscales` attributes.
+    the HDF5 dataset's `multiscales` attributes. Paths into `.h5`, `.hdf5` or `.hdf`
+    files are read as HDF5 right away, other paths only fall back to HDF5 if
+    `read_xarray` fails for them.
 
     path (str | Path): The path to the array to load.
     chunks (Literal["auto"] | tuple[int, ...], optional): The chunks to use for the
@@ -184,6 +268,16 @@ def read_any_xarray(
         `DataTree`.
 
     """
+    if _is_h5_path(path):
+        return read_h5_xarray(
+            path,
+            chunks=chunks,
+            coords=coords,
+            use_dask=use_dask,
+            attrs=attrs,
+            name=name,
+            **kwargs,
+        )
     try:
         return read_xarray(
             path,
@@ -225,11 +319,55 @@ def get_url(node: h5py.Dataset) -> str:
     return f"{protocol}://{store_path}"
 
 
+def _aggregate_chunks(arr: h5py.Dataset) -> tuple[int, ...]:
+    # combine whole on-disk chunks, starting along the slowest varying axis, until a
+    # chunk reaches the target size
+    target_bytes = int(os.environ.get("CELLMAP_DASK_CHUNK_BYTES", _DASK_CHUNK_BYTES))
+    chunks = list(arr.chunks or arr.shape)
+    if arr.size == 0:
+        return tuple(chunks)
+    for axis, size in enumerate(arr.shape):
+        chunk_bytes = math.prod(chunks) * arr.dtype.itemsize
+        if chunk_bytes >= target_bytes:
+            break
+        factor = min(
+            math.ceil(size / chunks[axis]), math.ceil(target_bytes / chunk_bytes)
+        )
+        chunks[axis] = min(chunks[axis] * factor, size)
+    return tuple(chunks)
+
+
+def _next_prime(n: int) -> int:
+    n = max(n, 2)
+    while any(n % k == 0 for k in range(2, math.isqrt(n) + 1)):
+        n += 1
+    return n
+
+
+def _chunk_cache_options(
+    chunks: Literal["auto", "inherit", "aggregate"] | tuple[int, ...],
+) -> dict[str, Any]:
+    # with the default chunk cache, the hdf5 chunks a dask block spans are evicted
+    # and decompressed again for every read. For explicit chunks the cache is sized
+    # to hold two blocks; the dtype isn't known before opening, so 8 byte elements are
+    # assumed. The cache is held by every open dataset of the file, so the much larger
+    # blocks of "auto" and "aggregate" keep the default cache.
+    if isinstance(chunks, str):
+        return {}
+    nbytes = 2 * math.prod(chunks) * 8
+    if nbytes <= _H5_DEFAULT_CACHE_BYTES:
+        return {}
+    # HDF5 recommends a prime number of hash slots that is well above the number of
+    # chunks fitting into the cache
+    nslots = _next_prime(10 * math.ceil(nbytes / _H5_MIN_CHUNK_BYTES))
+    return {"rdcc_nbytes": nbytes, "rdcc_nslots": nslots}
+
+
 # adapted from fibsem_tools.io.zarr.core.to_dask
 def to_dask(
     arr: h5py.Dataset,
     *,
-    chunks: Literal["auto", "inherit"] | tuple[int, ...] = "auto",
+    chunks: Literal["auto", "inherit", "aggregate"] | tuple[int, ...] = "auto",
     inline_array: bool = True,
     **kwargs: Any,
 ) -> da.Array:
@@ -239,11 +377,15 @@ def to_dask(
 
     Args:
         arr (h5py.Dataset): HDF5 dataset to turn into dask array.
-        chunks (Literal["auto", "inherit"] | tuple[int, ...], optional): The chunks to
-            use for the output Dask array. "inherit" allows to use the chunk size of the
-            input array for this parameter, but be advised that Dask performance suffers
-            when arrays have too many chunks, and h5py Datasets routinely have too many
-            chunks by this definition. Defaults to "auto".
+        chunks (Literal["auto", "inherit", "aggregate"] | tuple[int, ...], optional):
+            The chunks to use for the output Dask array. "inherit" allows to use the
+            chunk size of the input array for this parameter, but be advised that Dask
+            performance suffers when arrays have too many chunks, and h5py Datasets
+            routinely have too many chunks by this definition. "aggregate" combines
+            neighboring chunks of the input array until a chunk holds at least
+            `CELLMAP_DASK_CHUNK_BYTES` bytes (environment variable, 100 MiB by default),
+            so chunks stay aligned with the input array's chunks without creating too
+            many of them. Defaults to "auto".
         inline_array (bool, optional): Whether the h5py.Dataset should be inlined in the
             Dask compute graph. See documentation for `dask.array.from_array` for
             details. Defaults to True.
@@ -257,9 +399,36 @@ def to_dask(
         kwargs["name"] = f"{get_url(arr)}-{tokenize(arr)}"
     if chunks == "inherit":
         chunks = arr.chunks
+    elif chunks == "aggregate":
+        chunks = _aggregate_chunks(arr)
     return da.from_array(arr, chunks=chunks, inline_array=inline_array, **kwargs)
 
 
+def _read_direct_getter(
+    a: h5py.Dataset, b: Any, *, asarray: bool = True, lock: Any = None
+) -> np.ndarray:
+    # reads plain blocks straight into a preallocated array instead of going through
+    # h5py's generic indexing, anything else is left to dask's default getter
+    if not (
+        isinstance(b, tuple)
+        and len(b) == a.ndim
+        and all(isinstance(sl, slice) and sl.step in (None, 1) for sl in b)
+    ):
+        return getter(a, b, asarray=asarray, lock=lock)
+    shape = tuple(len(range(*sl.indices(size))) for sl, size in zip(b, a.shape))
+    out = np.empty(shape, dtype=a.dtype)
+    if out.size == 0:
+        return out
+    if lock:
+        lock.acquire()
+    try:
+        a.read_direct(out, source_sel=b)
+    finally:
+        if lock:
+            lock.release()
+    return out
+
+
 # adapted from xarray_ome_ngff.array_wrap.ZarrArrayWrapper
 @dataclass
 class HDFArrayWrapper(BaseArrayWrapper):
@@ -268,13 +437,32 @@ class HDFArrayWrapper(BaseArrayWrapper):
     def wrap(self, data: h5py.Dataset) -> np.ndarray:
         """Read the HDF5 Dataset.
 
+        Contiguous, unfiltered datasets are memory-mapped instead of being read, so
+        only the parts that are accessed are loaded from disk.
+
         Args:
             data (h5py.Dataset): Data to be read
 
         Returns:
-            np.ndarray: numpy array of `data`
+            np.ndarray: numpy array of `data`, read-only if it is memory-mapped
 
         """
+        if (
+            data.chunks is None
+            and not data.compression
+            and data.file.driver == "sec2"
+            and data.size > 0
+        ):
+            # the offset is None if no storage has been allocated for the data yet
+            offset = data.id.get_offset()
+            if offset is not None:
+                return np.memmap(
+                    data.file.filename,
+                    dtype=data.dtype,
+                    mode="r",
+                    offset=offset,
+                    shape=data.shape,
+                )
         return data[:]
 
 
@@ -306,19 +494,54 @@ class HDFDaskArrayWrapper(BaseArrayWrapper):
             name = None
         elif self.naming == "array_url":
             name = f"{get_url(data)}"
+        chunks = _aggregate_chunks(data) if self.chunks == "aggregate" else self.chunks
+        # unfiltered data doesn't need to go through the filter pipeline and can be
+        # read directly into the block
+        unfiltered = data.id.get_create_plist().get_nfilters() == 0
+        getitem = _read_direct_getter if unfiltered else None
         return da.from_array(
             data,
-            chunks=self.chunks,
+            chunks=chunks,
             inline_array=self.inline_array,
             meta=self.meta,
             name=name,
+            getitem=getitem,
+        )
+
+
+@dataclass
+class HDFLazyArrayWrapper(BaseArrayWrapper):
+    """An Array wrapper that wraps `h5py.Dataset` in a dask array with a single chunk.
+
+    Unlike `HDFArrayWrapper`, nothing is read when wrapping. Selections on the
+    resulting `xarray.DataArray` (e.g. `isel` or `sel`) only read the selected part of
+    the dataset once computed, while reading everything still happens in one go.
+    """
+
+    inline_array: bool = True
+
+    def wrap(self, data: h5py.Dataset) -> DaskArray:
+        """Wrap the HDF5 Dataset in a dask array with a single chunk.
+
+        Args:
+            data (h5py.Dataset): Data to be read
+
+        Returns:
+            DaskArray: Dask Array of `data`.
+
+        """
+        return da.from_array(
+            data, chunks=-1, inline_array=self.inline_array, name=get_url(data)
         )
 
 
 # adapted from xarray_ome_ngff.v04.multiscale
 def read_multiscale_array(
     array: h5py.Dataset,
-    array_wrapper: HDFArrayWrapper | HDFDaskArrayWrapper | None = None,
+    array_wrapper: HDFArrayWrapper
+    | HDFDaskArrayWrapper
+    | HDFLazyArrayWrapper
+    | None = None,
 ) -> DataArray:
     """Read a single HDF5 dataset as an `xarray.DataArray`, using a h5ification of
     version 0.4 OME-NGFF multiscale metadata.
@@ -336,8 +559,8 @@ def read_multiscale_array(
             multiscale image.
         array_wrapper (HDFArrayWrapper | HDFDaskArrayWrapper | None, optional): The
             array wrapper class to use when converting the HDF5 dataset to an
-            `xarray.DataArray`. Defaults to None, which then uses a default
-            `HDFArrayWrapper`.
+            `xarray.DataArray`, `HDFLazyArrayWrapper` can be used as well. Defaults to
+            None, which then uses a default `HDFArrayWrapper`.
 
     Raises:
         FileNotFoundError: If no h5ified 0.4 OME-NGFF multiscale metadata is found.
@@ -349,25 +572,26 @@ def read_multiscale_array(
     """
     if array_wrapper is None:
         array_wrapper = HDFArrayWrapper()
-    node = array
-    for _ in range(array.name.count("/") + 1):
-        try:
-            model = HDFMultiscaleGroup.from_hdf(node.parent)
-            for multi in model.attributes.multiscales:
-                multi_tx = multi.coordinateTransformations
-                for dset in multi.datasets:
-                    if dset.path == array.name.split("/")[-1]:
-                        tx_fused = normalize_transforms(
-                            multi_tx, dset.coordinateTransformations
-                        )
-                        coords = coords_from_transforms(
-                            axes=multi.axes, transforms=tx_fused, shape=array.shape
-                        )
-                        array = array_wrapper.wrap(array)
-
-                        return DataArray(array, coords=coords)
-        except KeyError:
-            node = node.parent
+    leaf = array.name.rsplit("/", 1)[-1]
+    # only ancestors that have multiscales metadata are parsed, and each only once
+    node = array.parent
+    while True:
+        if "multiscales" in node.attrs:
+            match = _index_multiscales(node.attrs["multiscales"]).get(leaf)
+            if match is not None:
+                multi, dset = match
+                tx_fused = normalize_transforms(
+                    multi.coordinateTransformations, dset.coordinateTransformations
+                )
+                coords = coords_from_transforms(
+                    axes=multi.axes, transforms=tx_fused, shape=array.shape
+                )
+                array = array_wrapper.wrap(array)
+
+                return DataArray(array, coords=coords)
+        if node.name == "/":
+            break
+        node = node.parent
     msg = (
         "Could not find version 0.4 OME-NGFF multiscale metadata in any HDF group"
         f"ancestral to the array at {array.name}"
@@ -380,7 +604,7 @@ def create_inferred_dataarray(
     element: h5py.Dataset,
     *,
     use_dask: bool = True,
-    chunks: tuple[int, ...] | Literal["auto", "inherit"] = "auto",
+    chunks: tuple[int, ...] | Literal["auto", "inherit", "aggregate"] = "auto",
     name: str | None = None,
 ) -> DataArray:
     """Create a DataArray from a HDF5 dataset with h5ified OME-NGFF version 0.4
@@ -390,9 +614,9 @@ def create_inferred_dataarray(
         element (h5py.Dataset): The HDF5 dataset
         use_dask (bool, optional): Whether to wrap the result in a dask array. Defaults
             to True.
-        chunks (tuple[int, ...] | Literal["auto", "inherit"], optional): The chunks to
-            use for the returned array.. Ignored if `use_dask` is `False`. Defaults to
-            "auto".
+        chunks (tuple[int, ...] | Literal["auto", "inherit", "aggregate"], optional):
+            The chunks to use for the returned array.. Ignored if `use_dask` is `False`.
+            Defaults to "auto".
         name (str | None, optional): The name of the resulting array. Defaults to None,
             in which case it gets set automagically.
 
@@ -415,7 +639,7 @@ def create_inferred_dataarray(
 def create_dataarray(
     element: h5py.Dataset,
     *,
-    chunks: tuple[int, ...] | Literal["auto", "inherit"] = "auto",
+    chunks: tuple[int, ...] | Literal["auto", "inherit", "aggregate"] = "auto",
     coords: Literal["auto"] | Any = "auto",
     use_dask: bool = True,
     attrs: dict[str, Any] | None = None,
@@ -425,9 +649,9 @@ def create_dataarray(
 
     Args:
         element (h5py.Dataset): The HDF5 Dataset
-        chunks (tuple[int, ...] | Literal["auto", "inherit"], optional): The chunks to
-            use for the returned array. Ignored if `use_dask` is `False`. Defaults to
-            "auto".
+        chunks (tuple[int, ...] | Literal["auto", "inherit", "aggregate"], optional):
+            The chunks to use for the returned array. Ignored if `use_dask` is `False`.
+            Defaults to "auto".
         coords (Any, optional): If set to "auto" assumes dataset to be part of a h5ified
             OME-NGFF hierarchy and infers xarray coordinates from that. Otherwise, needs
             to be parasable as `coords` kwarg for DataArray. Defaults to "auto".
@@ -455,7 +679,7 @@ def create_dataarray(
 def create_datatree(
     element: h5py.Group,
     *,
-    chunks: Literal["auto", "inherit"] | tuple[int, ...] = "auto",
+    chunks: Literal["auto", "inherit", "aggregate"] | tuple[int, ...] = "auto",
     coords: Any = "auto",
     use_dask: bool = True,
     attrs: dict[str, Any] | None = None,
@@ -465,9 +689,9 @@ def create_datatree(
 
     Args:
         element (h5py.Group): The HDF5 Group
-        chunks (Literal["auto", "inherit"] | tuple[int, ...], optional): The chunks to
-            use for the arrays in the tree. Ignored if `use_dask` is `False`. Defaults
-            to "auto".
+        chunks (Literal["auto", "inherit", "aggregate"] | tuple[int, ...], optional):
+            The chunks to use for the arrays in the tree. Ignored if `use_dask` is
+            `False`. Defaults to "auto".
         coords (Any, optional): If set to "auto" assumes all datasets to be part of
             h5ified OME-NGFF hierarchy and infers xarray coordinates from that.
             Otherwise, needs to be parasable as `coords` kwarg for DataArray and all
@@ -493,13 +717,13 @@ def create_datatree(
         )
         raise NotImplementedError(msg)
     if name is None:
-        name = Path(element.name).name
+        name = element.name.rsplit("/", 1)[-1]
     if name == "":
         name = None
     # for child in element.values():
     #    print(Path(child.name).name)
     nodes = {
-        Path(child.name).name: create_dataelement(
+        child.name.rsplit("/", 1)[-1]: create_dataelement(
             child,
             chunks=chunks,
             coords=coords,
@@ -510,9 +734,7 @@ def create_datatree(
         for child in element.values()
     }
     if attrs is None:
-        attrs = {}
-        for attr, val in element.attrs.items():
-            attrs[attr] = json.loads(val)
+        attrs = _decode_hdf_attributes(element)
     nodes["/"] = Dataset(attrs=attrs)
 
     return DataTree.from_dict(nodes, name=name)
@@ -522,7 +744,7 @@ def create_datatree(
 def create_dataelement(
     element: h5py.Dataset | h5py.Group,
     *,
-    chunks: Literal["auto", "inherit"] | tuple[int, ...] = "auto",
+    chunks: Literal["auto", "inherit", "aggregate"] | tuple[int, ...] = "auto",
     coords: Literal["auto", "inherit"] | dict[Hashable, Any] = "auto",
     use_dask: bool = True,
     attrs: dict[str, Any] | None = None,
@@ -532,9 +754,9 @@ def create_dataelement(
 
     Args:
         element (h5py.Dataset | h5py.Group): The HDF5 Dataset or HDF5 Group
-        chunks (Literal["auto", "inherit"] | tuple[int, ...], optional): The chunks to
-            use for the arrays in the tree. Ignored if `use_dask` is `False`. Defaults
-            to "auto".
+        chunks (Literal["auto", "inherit", "aggregate"] | tuple[int, ...], optional):
+            The chunks to use for the arrays in the tree. Ignored if `use_dask` is
+            `False`. Defaults to "auto".
         coords (Any, optional): If set to "auto" assumes all datasets to be part of
             h5ified OME-NGFF hierarchy and infers xarray coordinates from that.
             Otherwise, needs to be parasable as `coords` kwarg for DataArray and all
@@ -568,7 +790,7 @@ def create_dataelement(
 def read_h5_xarray(
     path: PathLike,
     *,
-    chunks: Literal["auto", "inherit"] | tuple[int, ...] = "auto",
+    chunks: Literal["auto", "inherit", "aggregate"] | tuple[int, ...] = "auto",
     coords: Literal["auto", "inherit"] | dict[Hashable, Any] = "auto",
     use_dask: bool = True,
     attrs: dict[str, Any] | None = None,
@@ -592,12 +814,18 @@ def read_h5_xarray(
             from the HDF5 attributes.
         name (str | None, optional): Name of this node in the tree. Defaults to None.
         kwargs (Any) : Additional keyword arguments passed on to `fibsem_tools.read`.
+            If `use_dask` is True and `chunks` is a tuple, the HDF5 chunk cache is
+            sized to hold two dask chunks unless `rdcc_nbytes` and `rdcc_nslots` are
+            given.
 
     Returns:
         DataTree | DataArray: Resulting DataArray (for HDF5 Dataset) or DataTree (for
             HDF5 Group)
 
     """
+    if use_dask:
+        # the chunk cache can only be configured when the file is opened
+        kwargs = {**_chunk_cache_options(chunks), **kwargs}
     element = read(path, **kwargs)
     return create_dataelement(
         element,
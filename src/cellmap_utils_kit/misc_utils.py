@@ -3,17 +3,27 @@ Utility functions for miscellaneous operations.
 
 This module provides utility functions for general-purpose tasks that may be
 used across various parts of the codebase, such as extracting specific patterns
-from strings.
+from strings or loading and saving data configuration yamls.
 
 Key Functions:
 -------------
 - `extract_crop_name(path: str) -> str | None`:
   Extracts the crop name from a given path string. It looks for the first
   occurrence of the pattern "crop" followed by a number and returns that name.
+- `extract_crop_names(paths: Iterable[str]) -> list[str | None]`:
+  Extracts the crop names from several paths.
+- `load_data_yaml(path: str | Path) -> dict`:
+  Loads a data configuration yaml, using the LibYAML based loader if available.
+- `dump_data_yaml(data_config: dict, path: str | Path) -> None`:
+  Saves a data configuration yaml, using the LibYAML based dumper if available.
+- `open_consolidated(path: str) -> zarr.Group | None`:
+  Opens a zarr group from its existing consolidated metadata.
 
 Dependencies:
 ------------
 - re: For regular expression operations.
+- yaml: For reading data configuration yamls.
+- zarr: For reading consolidated metadata of zarr groups.
 
 Usage:
 -----
@@ -30,6 +40,19 @@ print(crop_name)  # Output: crop12
 """
 
 import re
+from pathlib import Path
+from typing import Iterable
+
+import yaml
+import zarr
+
+try:
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML built without LibYAML
+    from yaml import SafeDumper, SafeLoader  # type: ignore[assignment]
+
+_CROP_RE = re.compile(r"crop\d+")
 
 
 def extract_crop_name(path: str) -> str | None:
@@ -44,5 +67,75 @@ def extract_crop_name(path: str) -> str | None:
         str | None: Name of the crop. If no crop name was found returns None.
 
     """
-    match = re.search(r"crop\d+", path)
+    match = _CROP_RE.search(path)
     return match.group(0) if match else None
+
+
+def extract_crop_names(paths: Iterable[str]) -> list[str | None]:
+    """Extract the crop names from several paths.
+
+    Same as calling `extract_crop_name` for each path.
+
+    Args:
+        paths (Iterable[str]): Paths from which to extract crop names
+
+    Returns:
+        list[str | None]: Names of the crops, None for paths without a crop name.
+
+    """
+    return [match.group(0) if match else None for match in map(_CROP_RE.search, paths)]
+
+
+def load_data_yaml(path: str | Path) -> dict:
+    """Load a data configuration yaml.
+
+    Uses the C implementation of the safe loader provided by LibYAML if PyYAML was
+    built with it, which is considerably faster for large configurations, and the
+    pure Python safe loader otherwise.
+
+    Args:
+        path (str | Path): Path to data configuration yaml.
+
+    Returns:
+        dict: The parsed data configuration.
+
+    """
+    with open(path) as f:
+        data_config: dict = yaml.load(f, Loader=SafeLoader)
+    return data_config
+
+
+def dump_data_yaml(data_config: dict, path: str | Path) -> None:
+    """Save a data configuration yaml.
+
+    Uses the C implementation of the safe dumper provided by LibYAML if PyYAML was
+    built with it and the pure Python safe dumper otherwise.
+
+    Args:
+        data_config (dict): The data configuration.
+        path (str | Path): Path to save the data configuration yaml to.
+
+    """
+    with open(path, "w") as f:
+        yaml.dump(data_config, f, Dumper=SafeDumper)
+
+
+def open_consolidated(path: str) -> zarr.Group | None:
+    """Open a zarr group from its existing consolidated metadata.
+
+    Consolidated metadata is only read, never written. It is not updated when the
+    group changes, e.g. by correcting attributes or adding scale levels, and is
+    only current if the group was (re)consolidated afterwards.
+
+    Args:
+        path (str): Path to the zarr group.
+
+    Returns:
+        zarr.Group | None: The group opened from its consolidated metadata, None if
+            `path` has no consolidated metadata.
+
+    """
+    try:
+        return zarr.open_consolidated(path, mode="r")
+    except (KeyError, ValueError):  # no consolidated metadata
+        return None
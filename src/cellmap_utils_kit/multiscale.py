@@ -17,22 +17,28 @@ Key Functions:
 - `smooth_multiscale_labels_main(data_yaml: str, num_scales: int = 4) -> None`:
     Creates a multiscale pyramid for labeled datasets specified in the provided
     configuration YAML. Supports smooth downsampling with maintenance of "unknown"
-    values.
+    values. With `resume`, scale levels that are already complete are kept.
+    The compression of the levels can be chosen with `compressor`.
 
 - `smooth_multiscale_raw_main(data_yaml: str, num_scales: int = 4, concurrence: int = 4)
    -> None`:
     Creates a multiscale pyramid for raw datasets from the provided YAML configuration.
     The number of concurrent processes for creating multiscales can be adjusted.
+    With `resume`, scale levels that are already complete are kept.
+    The compression of the levels can be chosen with `compressor`.
 
 Dependencies:
 -------------
-- asyncio: For managing asynchronous tasks.
+- asyncio, concurrent.futures: For processing crops in a bounded process pool.
+- os: For sharing the cores between concurrently processed crops.
+- functools: For binding the number of scales of the per-crop task.
 - itertools: To help iterate over scale levels for creating pyramids.
 - pathlib: For working with filesystem paths.
-- skimage: For performing downscaling on image data.
-- yaml: To read the dataset configuration from a YAML file.
+- numpy: For performing downscaling on image data.
+- numba (optional): For downscaling 3D data in a single pass.
 - fibsem_tools: For handling dataset access.
 - numcodecs: To apply compression while saving Zarr data.
+- zarr: For streaming scale levels slab by slab.
 
 Usage:
 ------
@@ -51,25 +57,53 @@ smooth_multiscale_raw_main("path/to/config.yaml", num_scales=4, concurrence=2)
 """
 
 import asyncio
+import functools
 import itertools
 import logging
+import os
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
 from pathlib import Path
-from typing import Literal
+from typing import Callable, Iterator, Literal
 
 import fibsem_tools as fst
 import numcodecs
 import numpy as np
-import skimage
-import yaml
+import zarr
+
+try:
+    import numba
+except ImportError:  # numba is optional, downscaling falls back to numpy
+    numba = None
 
 from cellmap_utils_kit.attribute_handler import (
     add_scalelevel_to_attributes,
+    get_res_dict_from_attrs,
     get_scale_and_translation,
 )
-from cellmap_utils_kit.parallel_utils import background
+from cellmap_utils_kit.misc_utils import load_data_yaml
+from cellmap_utils_kit.parallel_utils import gather_bounded
 
 logger = logging.getLogger(__name__)
 
+# bitshuffling exposes the byte structure of the float32 levels to zstd, which
+# compresses better and faster than zstd on its own. lz4 trades ratio for speed and
+# "none" skips compression, e.g. for intermediate levels that stay on a local disk.
+# Blosc's own threads are limited to each worker process's share of the cores, see
+# `_limit_worker_threads`.
+_COMPRESSORS: dict[str, numcodecs.abc.Codec | None] = {
+    "zstd": numcodecs.Blosc(cname="zstd", clevel=3, shuffle=numcodecs.Blosc.BITSHUFFLE),
+    "lz4": numcodecs.Blosc(cname="lz4", clevel=5, shuffle=numcodecs.Blosc.BITSHUFFLE),
+    "none": None,
+}
+# edge length of the (at most) cubic chunks of downscaled levels, which serve
+# slicing along any axis and compress better than single full-size z-slices
+_CHUNK_EDGE = 64
+
 
 def check_encoding(
     encoding: dict[Literal["present", "absent", "unknown"], int],
@@ -93,99 +127,270 @@ def check_encoding(
         raise ValueError(msg)
 
 
-@background
-def _smooth_multiscale_labels(crop_path: str | Path, num_scales: int = 4) -> None:
+def _downscaled_shape(shape: tuple[int, ...]) -> tuple[int, ...]:
+    # shape of skimage's downscale_local_mean(arr, 2) cropped to an even shape
+    return tuple((-(-n // 2)) // 2 * 2 for n in shape)
+
+
+if numba is not None:
+
+    @numba.njit(parallel=True, cache=True)
+    def _mean_2x2x2(arr: np.ndarray, out: np.ndarray) -> None:
+        # reads every voxel once and writes every output voxel once, without the
+        # intermediates of numpy's generic reduction. Blocks at the edge of an odd
+        # axis are clipped to `arr`, the missing voxels count as zero like padding.
+        for z in numba.prange(out.shape[0]):
+            nz = min(2, arr.shape[0] - 2 * z)
+            for y in range(out.shape[1]):
+                ny = min(2, arr.shape[1] - 2 * y)
+                for x in range(out.shape[2]):
+                    nx = min(2, arr.shape[2] - 2 * x)
+                    acc = np.float32(0)
+                    for dz in range(nz):
+                        for dy in range(ny):
+                            for dx in range(nx):
+                                acc += np.float32(
+                                    arr[2 * z + dz, 2 * y + dy, 2 * x + dx]
+                                )
+                    out[z, y, x] = acc / np.float32(8)
+
+
+def _downscale2(arr: np.ndarray, out: np.ndarray) -> np.ndarray:
+    # same result as skimage's downscale_local_mean(arr, 2) (which zero-pads odd
+    # axes) cropped to the shape of `out`. The input is cropped to the blocks that
+    # make up `out` first (a view), the 2x2x2 blocks are then averaged in float32
+    # straight into `out`. Only a block that is still incomplete after cropping (an
+    # axis of length 3 mod 4) needs padding, which the numba kernel does implicitly.
+    src_shape = tuple(2 * n for n in out.shape)
+    arr = arr[tuple(slice(n) for n in src_shape)]
+    if numba is not None and arr.ndim == 3:  # noqa: PLR2004
+        _mean_2x2x2(arr, out)
+        return out
+    if arr.shape != src_shape:
+        arr = np.pad(arr, [(0, s - n) for s, n in zip(src_shape, arr.shape)])
+    blocks = arr.reshape([x for n in out.shape for x in (n, 2)])
+    return blocks.mean(axis=tuple(range(1, blocks.ndim, 2)), dtype=np.float32, out=out)
+
+
+def _iter_downscaled(
+    src: zarr.Array | np.ndarray, level: np.ndarray, step: int
+) -> Iterator[tuple[int, np.ndarray]]:
+    # the source is read in z-slabs that downscale to `step` slices, i.e. one layer of
+    # output chunks, so every output chunk is written exactly once. Slabs are
+    # downscaled in place into the slices of `level`, which are yielded as views.
+    for z in range(0, level.shape[0], step):
+        out = level[z : z + step]
+        yield z, _downscale2(src[2 * z : 2 * (z + out.shape[0])], out)
+
+
+def _level_chunks(shape: tuple[int, ...]) -> tuple[int, ...]:
+    return tuple(max(1, min(n, _CHUNK_EDGE)) for n in shape)
+
+
+def _has_level(
+    group: zarr.Group, group_attrs: dict, level: str, shape: tuple[int, ...]
+) -> bool:
+    # a level counts as done if it has the expected shape and is listed in the
+    # multiscales attributes of its group, which are only written once all levels of
+    # the group are done
+    return (
+        level in group
+        and group[level].shape == shape
+        and level in get_res_dict_from_attrs(group_attrs)
+    )
+
+
+def _smooth_multiscale_labels(
+    crop_path: str | Path,
+    num_scales: int = 4,
+    *,
+    resume: bool = False,
+    compressor: Literal["zstd", "lz4", "none"] = "zstd",
+) -> None:
     crop = fst.access(crop_path, "a")
     if "labels" in crop:
         crop = crop["labels"]
     labels = crop.attrs["cellmap"]["annotation"]["class_names"]
-    for label in labels:
-        logger.info(f"Processing {crop_path} for {label}")
-        scales = [f"s{k}" for k in range(num_scales)]
-        for l1, l2 in itertools.pairwise(scales):
-            src = crop[f"{label}/{l1}"]
-            if (
-                src.attrs["cellmap"]["annotation"]["annotation_type"]["type"]
-                != "semantic_segmentation"
-            ):
-                msg = (
-                    f"smooth multiscaling not implemented for annotations of type "
-                    f"{src.attrs['cellmap']['annotation']['annotation_type']['type']}"
-                )
-                raise NotImplementedError(msg)
-            encoding = src.attrs["cellmap"]["annotation"]["annotation_type"]["encoding"]
-            check_encoding(encoding)
-            down = skimage.transform.downscale_local_mean(src[:], 2).astype("float32")
-            downslice = tuple(slice(sh) for sh in (np.array(down.shape) // 2) * 2)
-            down = down[downslice]
-            down[down > max(encoding["present"], encoding["absent"])] = encoding[
-                "unknown"
-            ]
-            attrs_as_dict = crop[f"{label}/{l1}"].attrs.asdict()
-            chunksize = (1, *down.shape[1:])
-            crop[label].create_dataset(
-                l2,
-                data=down,
-                overwrite=True,
-                dimension_separator="/",
-                compressor=numcodecs.Zstd(level=3),
-                chunks=chunksize,
+    # slabs are compressed and written in a separate thread while the next slab (or
+    # level) is downscaled, each slab is its own view into the level in memory
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        for label in labels:
+            logger.info(f"Processing {crop_path} for {label}")
+            _smooth_multiscale_label(
+                crop[label], writer, num_scales, resume=resume, compressor=compressor
             )
 
-            attrs_as_dict["cellmap"]["annotation"]["complement_counts"]["absent"] = (
-                round(
-                    np.sum(encoding["present"] - down[down != encoding["unknown"]]), 2
-                )
-            )
-            attrs_as_dict["cellmap"]["annotation"]["complement_counts"]["unknown"] = (
-                np.sum(down == encoding["unknown"])
-            )
-            crop[label][l2].attrs.put(attrs_as_dict)
-            l1_scale, l1_translation = get_scale_and_translation(
-                crop[label].attrs.asdict(), l1
-            )
-            l2_scale = [sc * 2 for sc in l1_scale]
-            l2_translation = [
-                (sc * 0.5) + tr for sc, tr in zip(l1_scale, l1_translation)
-            ]
-            new_attrs = add_scalelevel_to_attributes(
-                crop[label].attrs.asdict(), l2, l2_scale, l2_translation
-            )
-            crop[label].attrs.put(new_attrs)
 
-
-@background
-def _smooth_multiscale_raw(crop_path: str | Path, num_scales: int = 4) -> None:
-    crop = fst.access(crop_path, "a")
-    logger.info(f"Processing {crop_path} for raw")
+def _smooth_multiscale_label(
+    label_group: zarr.Group,
+    writer: Executor,
+    num_scales: int,
+    *,
+    resume: bool = False,
+    compressor: Literal["zstd", "lz4", "none"] = "zstd",
+) -> None:
     scales = [f"s{k}" for k in range(num_scales)]
+    # only s0 is read from disk, every further level is downscaled from the
+    # previous one, which is kept in memory (an eighth of the size of s0 at most)
+    prev = None
+    # the multiscales attributes of the label group are updated in memory and
+    # written once all levels are done
+    label_attrs = label_group.attrs.asdict()
+    writes: list[Future] = []
     for l1, l2 in itertools.pairwise(scales):
-        src = crop[f"raw/{l1}"]
-        down = skimage.transform.downscale_local_mean(src[:], 2).astype("float32")
-        downslice = tuple(slice(sh) for sh in (np.array(down.shape) // 2) * 2)
-        down = down[downslice]
-        chunksize = (1, *down.shape[1:])
-        crop["raw"].create_dataset(
+        src = label_group[l1]
+        attrs_as_dict = src.attrs.asdict()
+        annotation_type = attrs_as_dict["cellmap"]["annotation"]["annotation_type"]
+        if annotation_type["type"] != "semantic_segmentation":
+            msg = (
+                f"smooth multiscaling not implemented for annotations of type "
+                f"{annotation_type['type']}"
+            )
+            raise NotImplementedError(msg)
+        encoding = annotation_type["encoding"]
+        check_encoding(encoding)
+        source = src if prev is None else prev
+        out_shape = _downscaled_shape(source.shape)
+        if resume and _has_level(label_group, label_attrs, l2, out_shape):
+            prev = label_group[l2]
+            continue
+        chunks = _level_chunks(out_shape)
+        dst = label_group.create_dataset(
             l2,
-            data=down,
+            shape=out_shape,
+            dtype="float32",
             overwrite=True,
             dimension_separator="/",
-            compressor=numcodecs.Zstd(level=3),
-            chunks=chunksize,
+            compressor=_COMPRESSORS[compressor],
+            chunks=chunks,
         )
-        l1_scale, l1_translation = get_scale_and_translation(
-            crop["raw"].attrs.asdict(), l1
+        level = np.empty(out_shape, dtype="float32")
+        absent, unknown = 0.0, 0
+        for z, down in _iter_downscaled(source, level, chunks[0]):
+            # check_encoding guarantees that only the masked values equal unknown
+            # afterwards, so the one mask serves both counts
+            mask = down > max(encoding["present"], encoding["absent"])
+            down[mask] = encoding["unknown"]
+            writes.append(writer.submit(dst.__setitem__, slice(z, z + len(down)), down))
+            num_unknown = np.count_nonzero(mask)
+            np.logical_not(mask, out=mask)
+            absent += encoding["present"] * (down.size - num_unknown) - np.sum(
+                down, where=mask, dtype=np.float64
+            )
+            unknown += num_unknown
+        prev = level
+
+        attrs_as_dict["cellmap"]["annotation"]["complement_counts"]["absent"] = round(
+            absent, 2
         )
+        attrs_as_dict["cellmap"]["annotation"]["complement_counts"]["unknown"] = unknown
+        dst.attrs.put(attrs_as_dict)
+        l1_scale, l1_translation = get_scale_and_translation(label_attrs, l1)
         l2_scale = [sc * 2 for sc in l1_scale]
         l2_translation = [(sc * 0.5) + tr for sc, tr in zip(l1_scale, l1_translation)]
-        new_attrs = add_scalelevel_to_attributes(
-            crop["raw"].attrs.asdict(), l2, l2_scale, l2_translation
+        label_attrs = add_scalelevel_to_attributes(
+            label_attrs, l2, l2_scale, l2_translation
+        )
+    # the new levels are only listed once all of their data is written
+    for write in writes:
+        write.result()
+    label_group.attrs.put(label_attrs)
+
+
+def _smooth_multiscale_raw(
+    crop_path: str | Path,
+    num_scales: int = 4,
+    *,
+    resume: bool = False,
+    compressor: Literal["zstd", "lz4", "none"] = "zstd",
+) -> None:
+    crop = fst.access(crop_path, "a")
+    logger.info(f"Processing {crop_path} for raw")
+    scales = [f"s{k}" for k in range(num_scales)]
+    # only s0 is read from disk, every further level is downscaled from the previous
+    # one, which is kept in memory (an eighth of the size of s0 at most)
+    raw_group = crop["raw"]
+    raw_attrs = raw_group.attrs.asdict()
+    source = raw_group["s0"]
+    writes: list[Future] = []
+    # see _smooth_multiscale_labels
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        for l1, l2 in itertools.pairwise(scales):
+            out_shape = _downscaled_shape(source.shape)
+            if resume and _has_level(raw_group, raw_attrs, l2, out_shape):
+                source = raw_group[l2]
+                continue
+            chunks = _level_chunks(out_shape)
+            dst = raw_group.create_dataset(
+                l2,
+                shape=out_shape,
+                dtype="float32",
+                overwrite=True,
+                dimension_separator="/",
+                compressor=_COMPRESSORS[compressor],
+                chunks=chunks,
+            )
+            level = np.empty(out_shape, dtype="float32")
+            for z, down in _iter_downscaled(source, level, chunks[0]):
+                writes.append(
+                    writer.submit(dst.__setitem__, slice(z, z + len(down)), down)
+                )
+            source = level
+            l1_scale, l1_translation = get_scale_and_translation(raw_attrs, l1)
+            l2_scale = [sc * 2 for sc in l1_scale]
+            l2_translation = [
+                (sc * 0.5) + tr for sc, tr in zip(l1_scale, l1_translation)
+            ]
+            raw_attrs = add_scalelevel_to_attributes(
+                raw_attrs, l2, l2_scale, l2_translation
+            )
+        # the new levels are only listed once all of their data is written
+        for write in writes:
+            write.result()
+    raw_group.attrs.put(raw_attrs)
+
+
+def _limit_worker_threads(num_threads: int) -> None:
+    # levels are compressed in a writer thread, where blosc wouldn't use its own
+    # threads by default. numcodecs serializes blosc calls that use them.
+    numcodecs.blosc.use_threads = True
+    numcodecs.blosc.set_nthreads(num_threads)
+    # numba's thread count is set per calling thread, downscaling runs in the worker
+    # process's main thread, which also runs this initializer
+    if numba is not None:
+        numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
+
+
+async def _smooth_multiscale_async_main(
+    smooth_multiscale: Callable[[Path], None],
+    crop_paths: list[Path],
+    max_concurrency: None | int,
+) -> None:
+    # crops are downscaled in separate processes, so the numpy and python work of
+    # concurrent crops doesn't serialize on the GIL. A new crop is started as soon as
+    # any crop finishes instead of waiting for whole batches of crops.
+    cpu_count = os.cpu_count() or 1
+    threads_per_task = max(1, cpu_count // (max_concurrency or cpu_count))
+    with ProcessPoolExecutor(
+        max_workers=max_concurrency,
+        initializer=_limit_worker_threads,
+        initargs=(threads_per_task,),
+    ) as pool:
+        await gather_bounded(
+            smooth_multiscale,
+            ((crop_path,) for crop_path in crop_paths),
+            max_concurrency=max_concurrency,
+            executor=pool,
         )
-        crop["raw"].attrs.put(new_attrs)
 
 
 def smooth_multiscale_labels_main(
-    data_yaml: str, num_scales: int = 4, max_concurrency: int | None = None
+    data_yaml: str,
+    num_scales: int = 4,
+    max_concurrency: int | None = None,
+    *,
+    resume: bool = False,
+    compressor: Literal["zstd", "lz4", "none"] = "zstd",
 ) -> None:
     """Generate multiscale pyramid for labels.
 
@@ -199,33 +404,43 @@ def smooth_multiscale_labels_main(
         num_scales (int, optional): Desired number of scale levels. Defaults to 4.
         max_concurrency (int, optional): Maximum number of concurrent processes. If
             None, no limit is set. Defaults to None.
+        resume (bool, optional): If True, keep scale levels that already exist with
+            the expected shape and are listed in the multiscales attributes, e.g. to
+            resume an interrupted run. Whether they are up to date with s0 is not
+            checked. By default, all scale levels are recomputed. Defaults to False.
+        compressor (Literal["zstd", "lz4", "none"], optional): Compression of the
+            downscaled levels. "lz4" writes and reads faster at a lower compression
+            ratio, "none" is fastest for levels that are only consumed locally.
+            Defaults to "zstd".
 
     """
-    loop = asyncio.get_event_loop()
-    all_funcs = []
-    with open(data_yaml) as f:
-        datasets = yaml.safe_load(f)["datasets"]
-        for datainfo in datasets.values():
-            all_funcs.append(
-                asyncio.gather(
-                    *[
-                        _smooth_multiscale_labels(
-                            Path(datainfo["crop_group"]) / crop, num_scales=num_scales
-                        )
-                        for crop in datainfo["crops"]
-                    ]
-                )
-            )
-            if len(all_funcs) == max_concurrency:
-                looper = asyncio.gather(*all_funcs)
-                loop.run_until_complete(looper)
-                all_funcs = []
-    looper = asyncio.gather(*all_funcs)
-    loop.run_until_complete(looper)
+    datasets = load_data_yaml(data_yaml)["datasets"]
+    crop_paths = [
+        Path(datainfo["crop_group"]) / crop
+        for datainfo in datasets.values()
+        for crop in datainfo["crops"]
+    ]
+    asyncio.run(
+        _smooth_multiscale_async_main(
+            functools.partial(
+                _smooth_multiscale_labels,
+                num_scales=num_scales,
+                resume=resume,
+                compressor=compressor,
+            ),
+            crop_paths,
+            max_concurrency,
+        )
+    )
 
 
 def smooth_multiscale_raw_main(
-    data_yaml: str, num_scales: int = 4, max_concurrency: int | None = None
+    data_yaml: str,
+    num_scales: int = 4,
+    max_concurrency: int | None = None,
+    *,
+    resume: bool = False,
+    compressor: Literal["zstd", "lz4", "none"] = "zstd",
 ) -> None:
     """Generate multiscale pyramid for raw data.
 
@@ -237,29 +452,39 @@ def smooth_multiscale_raw_main(
         num_scales (int, optional): Desired number of scale levels. Defaults to 4.
         max_concurrency (int, optional): Maximum number of concurrent processes. If
             None, no limit is set. Defaults to None.
+        resume (bool, optional): If True, keep scale levels that already exist with
+            the expected shape and are listed in the multiscales attributes, e.g. to
+            resume an interrupted run. Whether they are up to date with s0 is not
+            checked. By default, all scale levels are recomputed. Defaults to False.
+        compressor (Literal["zstd", "lz4", "none"], optional): Compression of the
+            downscaled levels. "lz4" writes and reads faster at a lower compression
+            ratio, "none" is fastest for levels that are only consumed locally.
+            Defaults to "zstd".
 
     """
-    loop = asyncio.get_event_loop()
-    task_list = []
-    with open(data_yaml) as f:
-        datasets = yaml.safe_load(f)["datasets"]
-        for datainfo in datasets.values():
-            if "raw" in datainfo:
-                msg = (
-                    "The data configuration yaml contains a dataset-level path for "
-                    "raw data. Consider removing this. This script will attempt to "
-                    "multiscale `raw` group in each crop."
-                )
-                logger.warning(msg)
-            for crop in datainfo["crops"]:
-                task_list.append(
-                    _smooth_multiscale_raw(
-                        Path(datainfo["crop_group"]) / crop, num_scales=num_scales
-                    )
-                )
-                if len(task_list) == max_concurrency:
-                    looper = asyncio.gather(*task_list)
-                    loop.run_until_complete(looper)
-                    task_list = []
-        looper = asyncio.gather(*task_list)
-        loop.run_until_complete(looper)
+    datasets = load_data_yaml(data_yaml)["datasets"]
+    for datainfo in datasets.values():
+        if "raw" in datainfo:
+            msg = (
+                "The data configuration yaml contains a dataset-level path for "
+                "raw data. Consider removing this. This script will attempt to "
+                "multiscale `raw` group in each crop."
+            )
+            logger.warning(msg)
+    crop_paths = [
+        Path(datainfo["crop_group"]) / crop
+        for datainfo in datasets.values()
+        for crop in datainfo["crops"]
+    ]
+    asyncio.run(
+        _smooth_multiscale_async_main(
+            functools.partial(
+                _smooth_multiscale_raw,
+                num_scales=num_scales,
+                resume=resume,
+                compressor=compressor,
+            ),
+            crop_paths,
+            max_concurrency,
+        )
+    )
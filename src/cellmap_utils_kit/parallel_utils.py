@@ -1,38 +1,46 @@
 """cellmap_utils_kit.parallel_utils: Utility functions for parallelization."""
 
 import asyncio
-import functools
-from typing import Callable, ParamSpec, TypeVar
+from concurrent.futures import Executor
+from typing import Callable, Iterable, TypeVar
 
-P = ParamSpec("P")
 R = TypeVar("R")
 
 
-def background(f: Callable[P, R]) -> Callable[P, asyncio.Future[R]]:
-    """A decorator that allows a function to be run in a separate thread,
-    allowing it to be executed asynchronously.
+async def gather_bounded(
+    f: Callable[..., R],
+    args_list: Iterable[tuple],
+    max_concurrency: int | None = None,
+    executor: Executor | None = None,
+) -> list[R]:
+    """Run `f` once for each tuple of arguments in `args_list` in `executor`, keeping
+    at most `max_concurrency` calls in flight at any time.
 
-    This decorator wraps a function and sumits it to an executor, which allows
-    the function to run in a non-blocking way. It can accept any arguments and
-    keyword arguments and returns an asynctio.Future that can be awaited.
+    Unlike submitting fixed-size batches, a new call is started as soon as any
+    running call finishes, so a single slow call does not hold up the others.
 
     Args:
-        f (Callable[P, R]): The function to be decorated. It can accept any
-            parameters and return any type.
+        f (Callable[..., R]): The (synchronous) function to run.
+        args_list (Iterable[tuple]): Positional arguments for each call of `f`.
+        max_concurrency (int, optional): Maximum number of calls that run at the same
+            time. If None, no limit is set beyond the size of `executor`. Defaults to
+            None.
+        executor (Executor, optional): Executor to run `f` in. If None, the event
+            loop's default executor is used. Defaults to None.
 
     Returns:
-        Callable[P, asyncio.Future[R]]: A wrapped function that, when called,
-            executes the original function in a separate thread and returns an
-            asyncio.Future
+        list[R]: Results of the calls of `f`, in the order of `args_list`.
 
     """
-
-    def wrapped(*args: P.args, **kwargs: P.kwargs) -> asyncio.Future[R]:
-        ff: Callable[..., R]  # generic callable
-        if kwargs:
-            ff = functools.partial(f, **kwargs)
-        else:
-            ff = f
-        return asyncio.get_event_loop().run_in_executor(None, ff, *args)
-
-    return wrapped
+    loop = asyncio.get_running_loop()
+    if max_concurrency is None:
+        return await asyncio.gather(
+            *(loop.run_in_executor(executor, f, *args) for args in args_list)
+        )
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(args: tuple) -> R:
+        async with semaphore:
+            return await loop.run_in_executor(executor, f, *args)
+
+    return await asyncio.gather(*(_run(args) for args in args_list))